@@ -0,0 +1,102 @@
+"""
+Compares the interval allocator in static_mapping.utils against the original
+linear host scan on /24, /20 and /16 networks, then times the interval allocator alone
+on IPv6 networks up to a /64, where a host scan could never finish.
+
+Run from the project root:
+
+    python -m benchmarks.bench_allocator
+"""
+import ipaddress
+import random
+import timeit
+
+from static_mapping.utils import find_next_available_ip, count_available_ips
+
+NETWORKS = ["10.0.0.1/24", "10.0.0.1/20", "10.0.0.1/16"]
+NETWORKS_V6 = ["fd00::1/112", "fd00::1/96", "fd00::1/64"]
+MAPPINGS = 10000
+REPEAT = 5
+
+
+def legacy_find_next_available_ip(existing_mappings, interface_ip, interface_subnet, dhcp_range_from, dhcp_range_to):
+    network = ipaddress.ip_network(f"{interface_ip}/{interface_subnet}", strict=False)
+    dhcp_start_ip = ipaddress.IPv4Address(dhcp_range_from)
+    dhcp_end_ip = ipaddress.IPv4Address(dhcp_range_to)
+    used_ips = {mapping.get("ipaddr") for mapping in existing_mappings if mapping.get("ipaddr")}
+    used_ips.add(interface_ip)
+    for ip_obj in network.hosts():
+        if (ip_obj < dhcp_start_ip or ip_obj > dhcp_end_ip) and str(ip_obj) not in used_ips:
+            return str(ip_obj)
+    return None
+
+
+def legacy_count_available_ips(existing_mappings, interface_ip, interface_subnet, dhcp_range_from, dhcp_range_to):
+    network = ipaddress.ip_network(f"{interface_ip}/{interface_subnet}", strict=False)
+    dhcp_start_ip = ipaddress.IPv4Address(dhcp_range_from)
+    dhcp_end_ip = ipaddress.IPv4Address(dhcp_range_to)
+    used_ips = {mapping.get("ipaddr") for mapping in existing_mappings if mapping.get("ipaddr")}
+    used_ips.add(interface_ip)
+    available_count = 0
+    for ip_obj in network.hosts():
+        if (ip_obj < dhcp_start_ip or ip_obj > dhcp_end_ip) and str(ip_obj) not in used_ips:
+            available_count += 1
+    return available_count
+
+
+def build_case(cidr, mappings, seed=0):
+    """Returns (existing_mappings, interface_ip, subnet, range_from, range_to) for a network."""
+    interface = ipaddress.ip_interface(cidr)
+    network = interface.network
+    hosts = list(network.hosts())
+    # Put the DHCP pool in the top quarter of the subnet, as pfSense defaults tend to.
+    pool_start = hosts[len(hosts) * 3 // 4]
+    pool_end = hosts[-1]
+    candidates = [ip for ip in hosts if ip < pool_start and ip != interface.ip]
+    rng = random.Random(seed)
+    # Fill the low end densely so the linear scan has to walk past the used block.
+    used = candidates[:min(mappings, len(candidates))]
+    rng.shuffle(used)
+    existing = [{"ipaddr": str(ip), "mac": f"02:00:00:{i >> 16 & 0xff:02x}:{i >> 8 & 0xff:02x}:{i & 0xff:02x}"} for i, ip in enumerate(used)]
+    return existing, str(interface.ip), str(network.prefixlen), str(pool_start), str(pool_end)
+
+
+def build_case_v6(cidr, mappings):
+    """Like build_case, computed arithmetically since an IPv6 network is far too big to list."""
+    interface = ipaddress.ip_interface(cidr)
+    network = interface.network
+    first = int(network.network_address) + 1
+    pool_start = int(network.network_address) + network.num_addresses // 2
+    existing = [{"ipaddrv6": str(ipaddress.IPv6Address(first + 1 + i)), "duid": f"00:03:00:01:02:00:00:{i >> 16 & 0xff:02x}:{i >> 8 & 0xff:02x}:{i & 0xff:02x}"}
+                for i in range(mappings)]
+    return existing, str(interface.ip), str(network.prefixlen), str(ipaddress.IPv6Address(pool_start)), str(network.broadcast_address)
+
+
+def bench(func, args):
+    return min(timeit.repeat(lambda: func(*args), number=1, repeat=REPEAT))
+
+
+def main():
+    print(f"{'network':<14}{'mappings':>9}  {'function':<10}{'legacy ms':>11}{'interval ms':>13}{'speedup':>9}")
+    for cidr in NETWORKS:
+        args = build_case(cidr, MAPPINGS)
+        assert find_next_available_ip(*args) == legacy_find_next_available_ip(*args)
+        assert count_available_ips(*args) == legacy_count_available_ips(*args)
+        for name, legacy, current in (
+            ("next", legacy_find_next_available_ip, find_next_available_ip),
+            ("count", legacy_count_available_ips, count_available_ips),
+        ):
+            legacy_time = bench(legacy, args)
+            current_time = bench(current, args)
+            print(f"{cidr:<14}{len(args[0]):>9}  {name:<10}{legacy_time * 1000:>11.2f}{current_time * 1000:>13.2f}{legacy_time / current_time:>8.1f}x")
+
+    print(f"\n{'network':<14}{'mappings':>9}  {'function':<10}{'interval ms':>13}  result")
+    for cidr in NETWORKS_V6:
+        args = build_case_v6(cidr, MAPPINGS)
+        for name, current in (("next", find_next_available_ip), ("count", count_available_ips)):
+            current_time = bench(current, args)
+            print(f"{cidr:<14}{len(args[0]):>9}  {name:<10}{current_time * 1000:>13.2f}  {current(*args)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+Stand-in for the pfREST v2 endpoints used by static_mapping.api, for benchmarks and
+stress runs without a real firewall.
+
+Run standalone with, for example:
+
+    python -m benchmarks.fake_pfsense --port 8080 --interfaces 300 --mappings 100
+"""
+import argparse
+import ipaddress
+import json
+import multiprocessing
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+API_PREFIX = "/api/v2"
+
+
+def config_text(port, interface, **options):
+    """Returns a config.ini [pfsense] section for a fake server on port. Extra options are appended."""
+    lines = [
+        "[pfsense]",
+        "ip = 127.0.0.1",
+        "api_key = fake",
+        f"interface = {interface}",
+        f"port = {port}",
+        "verify_ssl = false",
+        "use_https = false",
+    ]
+    lines += [f"{key} = {value}" for key, value in options.items()]
+    return "\n".join(lines) + "\n"
+
+
+class FakePfSense:
+    """
+    In-memory pfSense with `interfaces` DHCP-enabled interfaces of the given prefix length,
+    each pre-populated with `mappings` static mappings.
+
+    latency adds a fixed delay (seconds) to every request, error_rate makes that fraction
+    of requests fail with HTTP 500, and reject_duplicates makes static_mapping POSTs fail
+    on an IP, MAC or hostname that is already mapped on the interface. With ipv6, every
+    interface also gets a /64 and a DHCPv6 server with the same number of mappings.
+    """
+
+    def __init__(self, interfaces=3, mappings=0, prefix=24, latency=0.0, error_rate=0.0,
+                 reject_duplicates=False, seed=0, ipv6=False):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.reject_duplicates = reject_duplicates
+        self.calls = Counter()
+        self.applies = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self.interfaces = {}
+        self.dhcp = {}
+        self.dhcpv6 = {}
+
+        subnets = ipaddress.ip_network("10.0.0.0/8").subnets(new_prefix=prefix)
+        subnets6 = ipaddress.ip_network("fd00::/48").subnets(new_prefix=64)
+        for number in range(interfaces):
+            network = next(subnets)
+            self.add_interface(f"opt{number + 1}", network, mappings)
+            if ipv6:
+                self.add_interface_v6(f"opt{number + 1}", next(subnets6), mappings)
+
+    def add_interface(self, name, network, mappings=0, enable=True):
+        first = int(network.network_address) + 1
+        last = int(network.broadcast_address) - 1
+        pool_start = first + (last - first) * 3 // 4
+        self.interfaces[name] = {
+            "if": name,
+            "descr": name.upper(),
+            "enable": True,
+            "typev4": "static",
+            "ipaddr": str(ipaddress.IPv4Address(first)),
+            "subnet": network.prefixlen,
+        }
+        staticmap = []
+        for offset in range(min(mappings, pool_start - first - 1)):
+            staticmap.append(self._mapping(name, len(staticmap), str(ipaddress.IPv4Address(first + 1 + offset))))
+        self.dhcp[name] = {
+            "id": name,
+            "enable": enable,
+            "range_from": str(ipaddress.IPv4Address(pool_start)),
+            "range_to": str(ipaddress.IPv4Address(last)),
+            "defaultleasetime": 7200,
+            "maxleasetime": 86400,
+            "staticmap": staticmap,
+        }
+
+    def add_interface_v6(self, name, network, mappings=0, enable=True):
+        """Gives an existing interface an IPv6 network and a DHCPv6 server. The pool is the top half of the network."""
+        first = int(network.network_address) + 1
+        pool_start = int(network.network_address) + network.num_addresses // 2
+        self.interfaces[name].update(typev6="staticv6", ipaddrv6=str(ipaddress.IPv6Address(first)), subnetv6=network.prefixlen)
+        staticmap = []
+        for offset in range(mappings):
+            staticmap.append(self._mapping_v6(name, offset, str(ipaddress.IPv6Address(first + 1 + offset))))
+        self.dhcpv6[name] = {
+            "id": name,
+            "enable": enable,
+            "range_from": str(ipaddress.IPv6Address(pool_start)),
+            "range_to": str(ipaddress.IPv6Address(int(network.broadcast_address))),
+            "staticmap": staticmap,
+        }
+
+    def _mapping_v6(self, interface, number, ip_address, duid=None, hostname=None, descr=None):
+        return {
+            "id": number,
+            "parent_id": interface,
+            "duid": duid or f"00:03:00:01:{':'.join(f'{byte:02x}' for byte in self._random.getrandbits(48).to_bytes(6, 'big'))}",
+            "ipaddrv6": ip_address,
+            "hostname": hostname or f"{interface}-v6host{number}",
+            "domain": "",
+            "domainsearchlist": [""],
+            "descr": descr or "",
+        }
+
+    def _mapping(self, interface, number, ip_address, mac=None, hostname=None, descr=None):
+        serial = self._random.getrandbits(40)
+        return {
+            "id": number,
+            "parent_id": interface,
+            "mac": mac or f"02:{serial >> 32 & 0xff:02x}:{serial >> 24 & 0xff:02x}:{serial >> 16 & 0xff:02x}:{serial >> 8 & 0xff:02x}:{serial & 0xff:02x}",
+            "ipaddr": ip_address,
+            "cid": hostname or f"{interface}-host{number}",
+            "hostname": hostname or f"{interface}-host{number}",
+            "domain": "",
+            "domainsearchlist": [""],
+            "defaultleasetime": 7200,
+            "maxleasetime": 86400,
+            "gateway": "",
+            "dnsserver": [""],
+            "winsserver": [""],
+            "ntpserver": [""],
+            "arp_table_static_entry": False,
+            "descr": descr or "",
+        }
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self, host="127.0.0.1", port=0):
+        """Serves on a background thread and returns the bound port."""
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.port
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def config_text(self, **options):
+        """Returns a config.ini pointing at this server. Extra options go in [pfsense]."""
+        return config_text(self.port, next(iter(self.interfaces), "lan"), **options)
+
+    def all_mappings(self):
+        with self._lock:
+            return {name: list(dhcp["staticmap"]) for name, dhcp in self.dhcp.items()}
+
+    def all_mappings_v6(self):
+        with self._lock:
+            return {name: list(dhcp["staticmap"]) for name, dhcp in self.dhcpv6.items()}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers and body go out in separate writes; without this, delayed ACKs add ~40 ms.
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _ok(self, data):
+                self._send(200, {"code": 200, "status": "ok", "response_id": "SUCCESS", "message": "", "data": data})
+
+            def _error(self, status, message):
+                self._send(status, {"code": status, "status": "error", "response_id": "ERROR", "message": message, "data": []})
+
+            def _begin(self, method):
+                if fake._server is None:
+                    # Stopped: also drop keep-alive connections opened before stop()
+                    self.close_connection = True
+                    return None
+                path = urlparse(self.path).path
+                with fake._lock:
+                    fake.calls[(method, path)] += 1
+                    fail = fake.error_rate and fake._random.random() < fake.error_rate
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fail:
+                    self._error(500, "Injected failure")
+                    return None
+                return path
+
+            def do_GET(self):
+                if urlparse(self.path).path == "/_fake/stats":
+                    with fake._lock:
+                        stats = {"calls": sum(fake.calls.values()), "applies": fake.applies}
+                    return self._ok(stats)
+                path = self._begin("GET")
+                if path is None:
+                    return
+                query = parse_qs(urlparse(self.path).query)
+                interface = query.get("id", [None])[0]
+                with fake._lock:
+                    if path == f"{API_PREFIX}/interface/available_interfaces":
+                        data = [{"if": name, "mac": "", "in_use_by": name} for name in fake.interfaces]
+                    elif path == f"{API_PREFIX}/services/dhcp_server" and interface in fake.dhcp:
+                        data = dict(fake.dhcp[interface], staticmap=list(fake.dhcp[interface]["staticmap"]))
+                    elif path == f"{API_PREFIX}/services/dhcpv6_server" and interface in fake.dhcpv6:
+                        data = dict(fake.dhcpv6[interface], staticmap=list(fake.dhcpv6[interface]["staticmap"]))
+                    elif path == f"{API_PREFIX}/interface" and interface in fake.interfaces:
+                        data = dict(fake.interfaces[interface])
+                    else:
+                        data = None
+                if data is None:
+                    return self._error(404, "Not found")
+                self._ok(data)
+
+            def do_POST(self):
+                path = self._begin("POST")
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if path is None:
+                    return
+                if path in (f"{API_PREFIX}/services/dhcp_server/apply", f"{API_PREFIX}/services/dhcpv6_server/apply"):
+                    with fake._lock:
+                        fake.applies += 1
+                    return self._ok({"applied": True})
+                if path == f"{API_PREFIX}/services/dhcpv6_server/static_mapping":
+                    with fake._lock:
+                        dhcp = fake.dhcpv6.get(body.get("parent_id"))
+                        if dhcp is None:
+                            return self._error(404, "Parent interface not found")
+                        if fake.reject_duplicates:
+                            for existing in dhcp["staticmap"]:
+                                if (existing["ipaddrv6"] == body.get("ipaddrv6") or existing["duid"].lower() == str(body.get("duid")).lower()
+                                        or existing["hostname"] == body.get("hostname")):
+                                    return self._error(400, "Duplicate static mapping")
+                        mapping = fake._mapping_v6(body["parent_id"], len(dhcp["staticmap"]), body.get("ipaddrv6"),
+                                                   body.get("duid"), body.get("hostname"), body.get("descr"))
+                        dhcp["staticmap"].append(mapping)
+                    return self._ok(mapping)
+                if path != f"{API_PREFIX}/services/dhcp_server/static_mapping":
+                    return self._error(404, "Not found")
+                with fake._lock:
+                    dhcp = fake.dhcp.get(body.get("parent_id"))
+                    if dhcp is None:
+                        return self._error(404, "Parent interface not found")
+                    if fake.reject_duplicates:
+                        for existing in dhcp["staticmap"]:
+                            if (existing["ipaddr"] == body.get("ipaddr") or existing["mac"].lower() == str(body.get("mac")).lower()
+                                    or existing["hostname"] == body.get("hostname")):
+                                return self._error(400, "Duplicate static mapping")
+                    mapping = fake._mapping(body["parent_id"], len(dhcp["staticmap"]), body.get("ipaddr"),
+                                            body.get("mac"), body.get("hostname"), body.get("descr"))
+                    dhcp["staticmap"].append(mapping)
+                self._ok(mapping)
+
+        return Handler
+
+
+def serve_in_subprocess(**options):
+    """
+    Starts a FakePfSense in a child process, so its JSON encoding does not compete with the
+    code under test for the GIL. Returns (process, port); stop it with process.terminate().
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(queue, options), daemon=True)
+    process.start()
+    return process, queue.get(timeout=60)
+
+
+def _serve(queue, options):
+    fake = FakePfSense(**options)
+    queue.put(fake.start())
+    while True:
+        time.sleep(3600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake pfSense REST API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--interfaces", type=int, default=3)
+    parser.add_argument("--mappings", type=int, default=0, help="Static mappings per interface.")
+    parser.add_argument("--prefix", type=int, default=24, help="Prefix length of each interface subnet.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay added to every request, in seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail with HTTP 500.")
+    parser.add_argument("--ipv6", action="store_true", help="Also serve a /64 and a DHCPv6 server per interface.")
+    args = parser.parse_args()
+
+    fake = FakePfSense(args.interfaces, args.mappings, args.prefix, args.latency, args.error_rate, ipv6=args.ipv6)
+    fake.start(args.host, args.port)
+    print(f"Fake pfSense listening on http://{args.host}:{fake.port}{API_PREFIX} with {args.interfaces} interfaces")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
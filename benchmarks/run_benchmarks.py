@@ -0,0 +1,209 @@
+"""
+End-to-end latency and throughput benchmarks for the web views and core functions,
+run against the fake pfSense server in benchmarks/fake_pfsense.py.
+
+For every scenario it reports p50/p95/p99 latency, throughput, upstream pfSense calls
+per request and peak Python memory. Save a run with --save and compare a later run
+against it with --baseline:
+
+    python -m benchmarks.run_benchmarks --interfaces 200 --mappings 500 --save before.json
+    python -m benchmarks.run_benchmarks --interfaces 200 --mappings 500 --baseline before.json
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import requests
+
+from benchmarks.fake_pfsense import config_text, serve_in_subprocess
+
+
+class RemoteFake:
+    """Reads upstream call counts from a fake pfSense running in another process."""
+
+    def __init__(self, port):
+        self.port = port
+
+    def total_calls(self):
+        response = requests.get(f"http://127.0.0.1:{self.port}/_fake/stats", timeout=10)
+        return response.json()["data"]["calls"]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    position = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[position]
+
+
+def measure(name, fake, func, iterations, warmup=1):
+    """Runs func `iterations` times and returns its latency, upstream call and memory figures."""
+    for _ in range(warmup):
+        func(0)
+    latencies = []
+    calls_before = fake.total_calls()
+    started = time.perf_counter()
+    for iteration in range(iterations):
+        begin = time.perf_counter()
+        func(iteration)
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+    calls = fake.total_calls() - calls_before
+
+    # Memory is traced in a separate run, since tracemalloc slows everything down.
+    tracemalloc.start()
+    func(iterations)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "name": name,
+        "iterations": iterations,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "throughput_rps": iterations / elapsed if elapsed else 0.0,
+        "upstream_calls": calls / iterations,
+        "peak_memory_kb": peak / 1024,
+    }
+
+
+def write_config(port, interface, workdir, cache):
+    from werkzeug.security import generate_password_hash
+    with open(os.path.join(workdir, "config.ini"), "w") as f:
+        f.write(config_text(port, interface, retries=0))
+        f.write("\n[cache]\n")
+        if cache == "off":
+            f.write("topology_ttl = 0\nmappings_ttl = 0\n")
+            f.write("\n[mirror]\nenabled = false\n")
+        else:
+            f.write(f"backend = {cache}\npath = {os.path.join(workdir, 'cache.sqlite3')}\n")
+            f.write(f"\n[mirror]\npath = {os.path.join(workdir, 'mirror.sqlite3')}\n")
+        f.write(f"\n[reservations]\npath = {os.path.join(workdir, 'reservations.sqlite3')}\n")
+        f.write(f"\n[auth]\nusername = bench\npassword_hash = {generate_password_hash('bench')}\n")
+
+
+def scenarios(interface):
+    """Yields (name, func) pairs. Imports happen here, after the working directory holds config.ini."""
+    from web import create_app
+    from static_mapping.config import load_config
+    from static_mapping.api import PfSenseAPI
+    from static_mapping.core import create_static_mapping_entry
+    from static_mapping.utils import find_next_available_ip, count_available_ips
+    from static_mapping.capacity import summarize
+
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.logger.setLevel(logging.WARNING)
+    client = app.test_client()
+    client.post("/login", data={"username": "bench", "password": "bench"})
+
+    def get(path):
+        def run(_):
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f"GET {path} returned {response.status_code}")
+        return run
+
+    yield "view GET /", get("/")
+    yield "view GET /api/interfaces", get("/api/interfaces")
+    yield f"view GET /api/interfaces/{interface}/capacity", get(f"/api/interfaces/{interface}/capacity")
+    yield f"view GET /get_available_ips/{interface}", get(f"/get_available_ips/{interface}")
+    yield "view GET /capacity", get("/capacity")
+
+    logger = logging.getLogger("benchmark")
+    pfsense_api = PfSenseAPI(load_config(), logger)
+    snapshot = pfsense_api.get_interface_snapshot(interface, fresh=True)
+    args = (snapshot.mappings, snapshot.ip_address, snapshot.subnet, snapshot.range_from, snapshot.range_to)
+
+    yield "core find_next_available_ip", lambda _: find_next_available_ip(*args)
+    yield "core count_available_ips", lambda _: count_available_ips(*args)
+    yield "core capacity summarize", lambda _: summarize(snapshot)
+    yield "api get_dhcp_interface_snapshots", lambda _: pfsense_api.get_dhcp_interface_snapshots()
+
+    serial = iter(range(1, 1 << 24))
+
+    def create(_):
+        number = next(serial)
+        mac = f"0e:00:00:{number >> 16 & 0xff:02x}:{number >> 8 & 0xff:02x}:{number & 0xff:02x}"
+        success, message, _, _ = create_static_mapping_entry(interface, mac, f"bench-{number}", "benchmark", logger)
+        if not success:
+            raise RuntimeError(message)
+
+    yield "core create_static_mapping_entry", create
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {entry["name"]: entry for entry in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    print(f"{'scenario':<46}{'p50 before':>12}{'p50 after':>11}{'change':>9}{'calls before':>14}{'calls after':>13}")
+    for result in results:
+        before = baseline.get(result["name"])
+        if not before:
+            continue
+        change = (result["p50_ms"] / before["p50_ms"] - 1) * 100 if before["p50_ms"] else 0.0
+        print(f"{result['name']:<46}{before['p50_ms']:>12.2f}{result['p50_ms']:>11.2f}{change:>8.0f}%"
+              f"{before['upstream_calls']:>14.1f}{result['upstream_calls']:>13.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the web views and core functions against a fake pfSense.")
+    parser.add_argument("--interfaces", type=int, default=50, help="Number of DHCP-enabled VLANs.")
+    parser.add_argument("--mappings", type=int, default=200, help="Static mappings per interface.")
+    parser.add_argument("--prefix", type=int, default=22, help="Prefix length of each interface subnet.")
+    parser.add_argument("--latency", type=float, default=0.002, help="Fake pfSense delay per request, in seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of upstream requests that fail.")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--cache", choices=["memory", "sqlite", "off"], default="memory",
+                        help="Cache backend; off also disables the mapping mirror.")
+    parser.add_argument("--only", help="Only run scenarios whose name contains this text.")
+    parser.add_argument("--save", help="Write results as JSON to this file.")
+    parser.add_argument("--baseline", help="Compare results with a JSON file written by --save.")
+    args = parser.parse_args()
+
+    process, port = serve_in_subprocess(interfaces=args.interfaces, mappings=args.mappings, prefix=args.prefix,
+                                        latency=args.latency, error_rate=args.error_rate)
+    fake = RemoteFake(port)
+    interface = "opt1"
+
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    save_path = os.path.abspath(args.save) if args.save else None
+    workdir = tempfile.mkdtemp(prefix="pfsense-bench-")
+    write_config(port, interface, workdir, args.cache)
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    print(f"{args.interfaces} interfaces x {args.mappings} mappings, /{args.prefix}, "
+          f"{args.latency * 1000:.1f} ms upstream latency, cache {args.cache}, {args.iterations} iterations\n")
+    print(f"{'scenario':<46}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'calls/req':>11}{'peak KB':>10}")
+    results = []
+    for name, func in scenarios(interface):
+        if args.only and args.only not in name:
+            continue
+        try:
+            result = measure(name, fake, func, args.iterations)
+        except RuntimeError as e:
+            print(f"{name:<46}failed: {e}")
+            continue
+        results.append(result)
+        print(f"{name:<46}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+              f"{result['throughput_rps']:>9.1f}{result['upstream_calls']:>11.1f}{result['peak_memory_kb']:>10.0f}")
+    process.terminate()
+
+    if save_path:
+        with open(save_path, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+    if baseline_path:
+        compare(results, baseline_path)
+
+
+if __name__ == "__main__":
+    main()
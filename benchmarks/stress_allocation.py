@@ -0,0 +1,86 @@
+"""
+Drives many concurrent create_static_mapping_entry calls, from several processes
+(like gunicorn workers) and several threads per process, against the fake pfSense
+server and checks that no IP address was handed out twice.
+
+Run from the project root:
+
+    python -m benchmarks.stress_allocation --processes 4 --threads 8 --per-thread 5
+    python -m benchmarks.stress_allocation --no-ledger   # shows the race without reservations
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_pfsense import FakePfSense
+
+
+def worker(worker_id, threads, per_thread, interface):
+    from static_mapping.core import create_static_mapping_entry
+    logger = logging.getLogger(f"stress.{worker_id}")
+
+    def create(thread_id):
+        outcomes = []
+        for number in range(per_thread):
+            serial = (worker_id << 16) | (thread_id << 8) | number
+            mac = f"0a:00:00:{serial >> 16 & 0xff:02x}:{serial >> 8 & 0xff:02x}:{serial & 0xff:02x}"
+            success, message, _, _ = create_static_mapping_entry(interface, mac, f"stress-{serial}", "stress test", logger)
+            outcomes.append((success, message))
+        return outcomes
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return [outcome for outcomes in executor.map(create, range(threads)) for outcome in outcomes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check concurrent static mapping creation for duplicate IPs.")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--per-thread", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake pfSense delay per request, in seconds.")
+    parser.add_argument("--no-ledger", action="store_true", help="Disable the reservation ledger.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    fake = FakePfSense(interfaces=1, prefix=22, latency=args.latency)
+    fake.start()
+    interface = next(iter(fake.interfaces))
+    before = {mapping["ipaddr"] for mapping in fake.all_mappings()[interface]}
+
+    workdir = tempfile.mkdtemp(prefix="stress-allocation-")
+    with open(os.path.join(workdir, "config.ini"), "w") as f:
+        f.write(fake.config_text(retries=0))
+        f.write("\n[reservations]\n")
+        f.write(f"enabled = {'false' if args.no_ledger else 'true'}\n")
+        f.write(f"path = {os.path.join(workdir, 'reservations.sqlite3')}\n")
+    os.chdir(workdir)
+
+    started = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        jobs = [pool.apply_async(worker, (worker_id, args.threads, args.per_thread, interface)) for worker_id in range(args.processes)]
+        outcomes = [outcome for job in jobs for outcome in job.get()]
+    elapsed = time.perf_counter() - started
+    fake.stop()
+
+    created = [mapping for mapping in fake.all_mappings()[interface] if mapping["ipaddr"] not in before]
+    counts = Counter(mapping["ipaddr"] for mapping in created)
+    duplicates = {ip: count for ip, count in counts.items() if count > 1}
+    failures = Counter(message for success, message in outcomes if not success)
+
+    print(f"attempts: {len(outcomes)}  created: {len(created)}  distinct IPs: {len(counts)}  duplicate IPs: {len(duplicates)}  "
+          f"elapsed: {elapsed:.2f}s  ledger: {'off' if args.no_ledger else 'on'}")
+    for message, count in failures.most_common(5):
+        print(f"  {count} failed: {message}")
+    if duplicates:
+        print(f"  duplicated: {sorted(duplicates.items())[:10]}")
+    sys.exit(1 if duplicates else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import argparse
+import logging
+import os
+import sys
+from static_mapping.bulk import parse_rows, import_static_mappings
+from static_mapping.config import load_config
+from static_mapping.fleet import FirewallFleet
+
+parser = argparse.ArgumentParser(description='Create many static mappings from a CSV or JSON file.')
+parser.add_argument('file', type=str, help='CSV (with a header row) or JSON file with mac_address, hostname, description and optional interface columns.')
+parser.add_argument('--format', choices=['csv', 'json'], help='Input format. Defaults to the file extension.')
+parser.add_argument('--interface', type=str, help='Interface for rows without an interface column. Defaults to the interface in config.ini.')
+parser.add_argument('--firewall', type=str, help='Firewall to import into, by its [firewall:<name>] section. Defaults to the first configured firewall.')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+logger = logging.getLogger('bulk_import')
+
+fmt = args.format or os.path.splitext(args.file)[1].lstrip('.').lower()
+try:
+    with open(args.file, 'rb') as f:
+        rows = parse_rows(f.read(), fmt)
+except (OSError, ValueError) as e:
+    sys.exit(f"Could not read {args.file}: {e}")
+
+config = load_config()
+fleet = FirewallFleet(config, logger)
+try:
+    pfsense_api = fleet.get(args.firewall) if args.firewall else fleet.default
+except KeyError as e:
+    sys.exit(e.args[0])
+
+results, applied = import_static_mappings(rows, logger, default_interface=args.interface, config=config, pfsense_api=pfsense_api, fleet=fleet)
+
+for result in results:
+    print(f"{result['row']:>5}  {result['status']:<8} {result['interface'] or '':<10} {result['mac_address']:<18} {result['hostname']:<24} {result['ip_address'] or '':<16} {result['message']}")
+
+created = sum(1 for result in results if result['status'] == 'created')
+print(f"\n{created} of {len(results)} mappings created. Changes {'applied' if applied else 'not applied'}.")
+sys.exit(0 if created == len(results) and (applied or not created) else 1)
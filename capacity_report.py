@@ -0,0 +1,52 @@
+import argparse
+import csv
+import json
+import logging
+import sys
+from static_mapping.capacity import REPORT_FIELDS, capacity_report
+from static_mapping.config import load_config
+from static_mapping.fleet import FirewallFleet
+
+parser = argparse.ArgumentParser(description='Report static mapping capacity, fragmentation and misplaced mappings of every DHCP-enabled interface.')
+parser.add_argument('--format', choices=['table', 'csv', 'json'], default='table', help='Output format. Defaults to table.')
+parser.add_argument('--version', type=int, choices=[4, 6], default=4, help='Report DHCP (4) or DHCPv6 (6) interfaces. Defaults to 4.')
+parser.add_argument('--firewall', type=str, action='append', help='Only report this firewall, by its [firewall:<name>] section. May be repeated.')
+parser.add_argument('--sort', choices=['utilisation', 'fragmentation', 'free'], default='utilisation', help='Sort order; utilisation and fragmentation sort highest first, free lowest first.')
+parser.add_argument('--details', action='store_true', help='List the mappings inside the DHCP pool or outside the subnet (table format).')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s: %(message)s', stream=sys.stderr)
+logger = logging.getLogger('capacity_report')
+
+fleet = FirewallFleet(load_config(), logger)
+for name in args.firewall or []:
+    if name not in fleet.firewalls:
+        sys.exit(f"Unknown firewall '{name}'.")
+
+summaries, errors = capacity_report(fleet, args.version, args.firewall)
+summaries.sort(key=lambda summary: summary[args.sort], reverse=args.sort != 'free')
+
+if args.format == 'json':
+    json.dump(summaries, sys.stdout, indent=2)
+    print()
+elif args.format == 'csv':
+    writer = csv.DictWriter(sys.stdout, fieldnames=REPORT_FIELDS, extrasaction='ignore', lineterminator='\n')
+    writer.writeheader()
+    for summary in summaries:
+        writer.writerow(dict(summary, in_pool=len(summary['in_pool']), outside_subnet=len(summary['outside_subnet'])))
+else:
+    print(f"{'Firewall':<12} {'Interface':<10} {'Network':<20} {'Free':>10} {'Used':>6} {'Util':>7} {'Largest':>10} {'Blocks':>6} {'Frag':>7} {'InPool':>6} {'Outside':>7}")
+    for summary in summaries:
+        print(f"{summary['firewall']:<12} {summary['interface']:<10} {summary['network']:<20} {summary['free']:>10} {summary['used']:>6} "
+              f"{summary['utilisation']:>7.1%} {summary['largest_free_block']:>10} {summary['free_blocks']:>6} {summary['fragmentation']:>7.1%} "
+              f"{len(summary['in_pool']):>6} {len(summary['outside_subnet']):>7}")
+        if args.details:
+            for mapping in summary['in_pool']:
+                print(f"    in pool:        {mapping['ipaddr']:<20} {mapping['hostname'] or '':<24} {mapping['mac'] or ''}")
+            for mapping in summary['outside_subnet']:
+                print(f"    outside subnet: {mapping['ipaddr']:<20} {mapping['hostname'] or '':<24} {mapping['mac'] or ''}")
+    print(f"\n{len(summaries)} interfaces, {sum(summary['free'] for summary in summaries)} free static mapping addresses.")
+
+for firewall, error in errors.items():
+    print(f"Firewall '{firewall}' did not respond: {error}", file=sys.stderr)
+sys.exit(1 if errors else 0)
@@ -0,0 +1,36 @@
+import argparse
+import logging
+import sys
+from static_mapping.config import load_config
+from static_mapping.export import EXPORT_FORMATS, iter_mapping_batches, export_chunks
+from static_mapping.fleet import FirewallFleet
+
+parser = argparse.ArgumentParser(description='Export the static mappings of every DHCP-enabled interface as CSV or NDJSON.')
+parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv', help='Output format. Defaults to csv.')
+parser.add_argument('--output', type=str, help='File to write to. Defaults to standard output.')
+parser.add_argument('--version', type=int, choices=[4, 6], default=4, help='Export DHCP (4) or DHCPv6 (6) static mappings. Defaults to 4.')
+parser.add_argument('--firewall', type=str, action='append', help='Only export this firewall, by its [firewall:<name>] section. May be repeated.')
+parser.add_argument('--fresh', action='store_true', help='Read from pfSense instead of the local mirror.')
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s: %(message)s', stream=sys.stderr)
+logger = logging.getLogger('export_mappings')
+
+fleet = FirewallFleet(load_config(), logger)
+for name in args.firewall or []:
+    if name not in fleet.firewalls:
+        sys.exit(f"Unknown firewall '{name}'.")
+
+errors = []
+out = open(args.output, 'w', newline='') if args.output else sys.stdout
+try:
+    for chunk in export_chunks(iter_mapping_batches(fleet, args.version, args.fresh, errors, args.firewall), args.format):
+        out.write(chunk)
+        out.flush()
+finally:
+    if args.output:
+        out.close()
+
+for firewall, interface, message in errors:
+    print(f"Skipped firewall '{firewall}'{f' interface {interface}' if interface else ''}: {message}", file=sys.stderr)
+sys.exit(1 if errors else 0)
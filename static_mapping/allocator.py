@@ -0,0 +1,143 @@
+import bisect
+import ipaddress
+import socket
+
+
+def mapping_ip(mapping):
+    """Returns the address of a pfSense static mapping: ipaddr for DHCP, ipaddrv6 for DHCPv6."""
+    return mapping.get("ipaddr") or mapping.get("ipaddrv6")
+
+
+class IPAllocator:
+    """
+    Tracks the free static-mapping space of a subnet as sorted integer intervals.
+
+    Blocked space (existing mappings, the interface IP and the DHCP pool) is kept as
+    a merged list of (start, end) integer intervals, so lookups cost O(k log k) in the
+    number of mappings instead of a walk over every host in the subnet. Nothing depends on
+    the subnet size, so the same code serves an IPv6 /64; counts are plain Python integers
+    and stay exact however large they get.
+    """
+
+    def __init__(self, network, dhcp_start=None, dhcp_end=None, used_ips=()):
+        self.network = network
+        self.first_host, self.last_host = self._host_bounds(network)
+
+        family = socket.AF_INET if network.version == 4 else socket.AF_INET6
+        pton = socket.inet_pton
+        points = set()
+        for ip in used_ips:
+            try:
+                points.add(int.from_bytes(pton(family, ip), "big"))
+            except (OSError, TypeError, ValueError):
+                continue
+
+        blocked = [(value, value) for value in sorted(points)]
+        if dhcp_start is not None and dhcp_end is not None and int(dhcp_start) <= int(dhcp_end):
+            bisect.insort(blocked, (int(dhcp_start), int(dhcp_end)))
+        self._blocked = self._merge(blocked)
+
+    @classmethod
+    def from_mappings(cls, existing_mappings, interface_ip, interface_subnet, dhcp_range_from, dhcp_range_to):
+        """
+        Builds an allocator from pfSense mapping dicts and interface/DHCP settings, for DHCP
+        (IPv4) or DHCPv6 alike. Raises ValueError if the addresses are invalid or of mixed families.
+        """
+        network = ipaddress.ip_network(f"{interface_ip}/{interface_subnet}", strict=False)
+        dhcp_start = ipaddress.ip_address(dhcp_range_from)
+        dhcp_end = ipaddress.ip_address(dhcp_range_to)
+        if dhcp_start.version != network.version or dhcp_end.version != network.version:
+            raise ValueError(f"DHCP range {dhcp_range_from}-{dhcp_range_to} is not in the address family of {network}")
+        used_ips = [mapping_ip(mapping) for mapping in existing_mappings if mapping_ip(mapping)]
+        used_ips.append(interface_ip)
+        return cls(network, dhcp_start, dhcp_end, used_ips)
+
+    @staticmethod
+    def _host_bounds(network):
+        first = int(network.network_address)
+        last = int(network.broadcast_address)
+        # Mirror ipaddress.hosts(): /31 and /32 (or /127, /128) have no reserved addresses.
+        if network.num_addresses > 2:
+            first += 1
+            if network.version == 4:
+                last -= 1
+        return first, last
+
+    def to_int(self, ip):
+        """Returns ip as an integer, or None if it is malformed or of the other address family."""
+        # inet_pton is several times faster than ipaddress.ip_address for bulk parsing
+        # and rejects addresses of the other family for us.
+        family = socket.AF_INET if self.network.version == 4 else socket.AF_INET6
+        try:
+            return int.from_bytes(socket.inet_pton(family, str(ip)), "big")
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _merge(intervals):
+        """Merges sorted (start, end) intervals that overlap or touch."""
+        merged = []
+        for start, end in intervals:
+            if merged and start <= merged[-1][1] + 1:
+                if end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return merged
+
+    def to_address(self, value):
+        """Returns the address string of an integer from to_int()."""
+        return str(type(self.network.network_address)(value))
+
+    def mark_used(self, ip):
+        """Marks a single address as used, keeping the blocked intervals merged."""
+        value = self.to_int(ip)
+        if value is None:
+            return
+        index = bisect.bisect_right(self._blocked, (value, value))
+        start, end = value, value
+        if index > 0 and self._blocked[index - 1][1] >= value - 1:
+            index -= 1
+            start = self._blocked[index][0]
+            end = max(end, self._blocked[index][1])
+            del self._blocked[index]
+        while index < len(self._blocked) and self._blocked[index][0] <= end + 1:
+            end = max(end, self._blocked[index][1])
+            del self._blocked[index]
+        self._blocked.insert(index, (start, end))
+
+    def free_ranges(self):
+        """Yields (start, end) integer intervals of free host addresses in ascending order."""
+        cursor = self.first_host
+        for start, end in self._blocked:
+            if end < cursor:
+                continue
+            if start > self.last_host:
+                break
+            if start > cursor:
+                yield cursor, start - 1
+            cursor = max(cursor, end + 1)
+            if cursor > self.last_host:
+                return
+        if cursor <= self.last_host:
+            yield cursor, self.last_host
+
+    def next_free(self):
+        """Returns the lowest free address as a string, or None if the subnet is full."""
+        for start, _ in self.free_ranges():
+            return self.to_address(start)
+        return None
+
+    def first_free(self, count):
+        """Returns up to `count` free addresses in ascending order."""
+        addresses = []
+        for start, end in self.free_ranges():
+            for value in range(start, min(end, start + count - len(addresses) - 1) + 1):
+                addresses.append(self.to_address(value))
+            if len(addresses) >= count:
+                break
+        return addresses
+
+    def count_free(self):
+        """Returns the number of free addresses."""
+        return sum(end - start + 1 for start, end in self.free_ranges())
@@ -1,16 +1,120 @@
 import requests
+import hashlib
 import json
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from dataclasses import dataclass, field
+from functools import cached_property
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .cache import get_cache
+from .capacity import cached_summary
+from .mapping_index import MappingIndex
+from .mirror import get_mirror
+from .metrics import instrumented, record_upstream, run_in_context, API_SECONDS, API_CALLS, API_ERRORS, CACHE_REQUESTS
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(base_url, retries=2, backoff_factor=0.5, pool_size=10):
+    """Returns the process-wide keep-alive session for a pfSense base URL; only GETs are retried."""
+    key = (base_url, retries, backoff_factor, pool_size)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            retry = Retry(
+                total=retries,
+                connect=retries,
+                read=retries,
+                status=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(["GET"]),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+        return session
+
+@dataclass
+class InterfaceSnapshot:
+    """DHCP server and interface settings for one interface, fetched together."""
+    interface: str
+    enabled: bool = False
+    mappings: list = field(default_factory=list)
+    range_from: str = None
+    range_to: str = None
+    ip_address: str = None
+    subnet: str = None
+    description: str = None
+    fetched_at: float = None
+    version: int = 4
+    # Set when the snapshot comes from the local mirror, which tracks a revision per interface
+    revision: str = None
+
+    def __post_init__(self):
+        # pfSense sends the prefix length as a number; the mirror stores it as text. Keep one type
+        # so JSON responses and their ETags do not change with where the snapshot came from.
+        if isinstance(self.subnet, str) and self.subnet.isdigit():
+            self.subnet = int(self.subnet)
+
+    @property
+    def has_addressing(self):
+        """True when the interface IP, subnet and DHCP range are all known."""
+        return bool(self.ip_address and self.subnet and self.range_from and self.range_to)
+
+    @cached_property
+    def etag(self):
+        """Hash of the upstream data in this snapshot, for HTTP conditional requests."""
+        if self.revision:
+            return hashlib.sha1(f"{self.interface}:{self.version}:{self.revision}".encode()).hexdigest()
+        data = [self.interface, self.version, self.enabled, self.mappings, self.range_from, self.range_to,
+                self.ip_address, self.subnet, self.description]
+        return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+    @cached_property
+    def index(self):
+        """MappingIndex over this snapshot's mappings, built on first use."""
+        return MappingIndex.from_snapshot(self)
+
+    def capacity(self):
+        """Returns free, used and DHCP pool sizes and the next free IP for this interface, from its cached capacity summary."""
+        summary = cached_summary(self) or {}
+        return {
+            'interface': self.interface,
+            'version': self.version,
+            'free': summary.get('free', 0),
+            'used': summary.get('used', 0),
+            'pool_size': summary.get('pool_size', 0),
+            'next_free_ip': summary.get('next_free_ip'),
+        }
+
+    @property
+    def label(self):
+        return f"{self.description} ({self.ip_address}/{self.subnet})"
 
 class PfSenseAPI:
-    def __init__(self, config, logger=None):
+    def __init__(self, config, logger=None, section='pfsense', name='default'):
+        """Client for the firewall in `section` of config: [pfsense] or a [firewall:<name>] section."""
         self.logger = logger or logging.getLogger(__name__)
-        self.pfsense_ip = config.get('pfsense', 'ip')
-        self.api_key = config.get('pfsense', 'api_key')
-        self.interface = config.get('pfsense', 'interface')
-        self.verify_ssl = config.getboolean('pfsense', 'verify_ssl')
-        self.port = config.get('pfsense', 'port', fallback='')
-        self.use_https = config.getboolean('pfsense', 'use_https', fallback=True)
+        self.name = name
+        self.pfsense_ip = config.get(section, 'ip')
+        self.api_key = config.get(section, 'api_key')
+        self.interface = config.get(section, 'interface')
+        self.verify_ssl = config.getboolean(section, 'verify_ssl')
+        self.port = config.get(section, 'port', fallback='')
+        self.use_https = config.getboolean(section, 'use_https', fallback=True)
+
+        self.timeout = (
+            config.getfloat(section, 'connect_timeout', fallback=5.0),
+            config.getfloat(section, 'read_timeout', fallback=30.0),
+        )
 
         scheme = "https" if self.use_https else "http"
         if self.port:
@@ -18,36 +122,92 @@ class PfSenseAPI:
         else:
             self.base_url = f"{scheme}://{self.pfsense_ip}/api/v2"
 
+        self.max_workers = config.getint(section, 'max_workers', fallback=8)
+        self.dhcpv6_path = config.get(section, 'dhcpv6_path', fallback='services/dhcpv6_server').strip('/')
+
+        # Interfaces and topology rarely change; the DHCP document carries the static mappings.
+        self.cache = get_cache(config)
+        self.topology_ttl = config.getfloat('cache', 'topology_ttl', fallback=300)
+        self.mappings_ttl = config.getfloat('cache', 'mappings_ttl', fallback=15)
+        self.mirror = get_mirror(config)
+
+        self.session = get_session(
+            self.base_url,
+            retries=config.getint(section, 'retries', fallback=2),
+            backoff_factor=config.getfloat(section, 'retry_backoff', fallback=0.5),
+            pool_size=config.getint(section, 'pool_size', fallback=10),
+        )
+
     def _get_headers(self):
         return {
             "X-API-Key": self.api_key,
             "Accept": "application/json"
         }
 
+    def _send(self, method, url, **kwargs):
+        """Sends one request through the shared session, recording its latency and outcome."""
+        endpoint = url[len(self.base_url):].split('?', 1)[0]
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, verify=self.verify_ssl, timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            record_upstream(self.name, method, endpoint, time.perf_counter() - start, error=True)
+            raise
+        record_upstream(self.name, method, endpoint, time.perf_counter() - start, str(response.status_code), error=response.status_code >= 400)
+        return response
+
+    def _get_data(self, url, ttl=0, fresh=False, default=None):
+        if ttl and not fresh:
+            data = self.cache.get(url)
+            CACHE_REQUESTS.inc(result='miss' if data is None else 'hit')
+            if data is not None:
+                return data
+        response = self._send('GET', url, headers=self._get_headers())
+        response.raise_for_status()
+        json_response = response.json()
+        data = json_response.get("data", {} if default is None else default)
+        if ttl:
+            self.cache.set(url, data, ttl)
+        return data
+
+    def _dhcp_url(self, version=4):
+        """Base URL of the DHCP (version 4) or DHCPv6 (version 6) server endpoints."""
+        if version == 6:
+            return f"{self.base_url}/{self.dhcpv6_path}"
+        return f"{self.base_url}/services/dhcp_server"
+
+    def _get_dhcp_server(self, interface, fresh=False, version=4):
+        return self._get_data(f"{self._dhcp_url(version)}?id={interface}", self.mappings_ttl, fresh)
+
+    def _get_interface(self, interface, fresh=False):
+        return self._get_data(f"{self.base_url}/interface?id={interface}", self.topology_ttl, fresh)
+
+    def invalidate_cache(self, interface=None):
+        """Drops the cached DHCP documents of one interface, or every cached read and mirrored mapping of this firewall."""
+        if interface:
+            self.cache.invalidate(f"{self._dhcp_url(4)}?id={interface}")
+            self.cache.invalidate(f"{self._dhcp_url(6)}?id={interface}")
+        else:
+            self.cache.invalidate(self.base_url)
+            if self.mirror:
+                self.mirror.invalidate(self.base_url)
+
+    @instrumented(API_SECONDS, API_CALLS, API_ERRORS)
     def get_existing_static_mappings(self, interface=None):
         if not interface:
             interface = self.interface
-        url = f"{self.base_url}/services/dhcp_server?id={interface}"
         try:
-            response = requests.get(url, headers=self._get_headers(), verify=self.verify_ssl)
-            response.raise_for_status()
-            json_response = response.json()
-            data = json_response.get("data", {})
-            static_maps = data.get("staticmap", [])
-            return static_maps
+            return self.get_interface_snapshot(interface).mappings
         except requests.exceptions.RequestException as e:
             self.logger.error(f"Error getting existing static mappings: {e}")
             raise e
 
+    @instrumented(API_SECONDS, API_CALLS, API_ERRORS)
     def get_interface_details(self, interface=None):
         if not interface:
             interface = self.interface
-        url = f"{self.base_url}/interface?id={interface}"
         try:
-            response = requests.get(url, headers=self._get_headers(), verify=self.verify_ssl)
-            response.raise_for_status()
-            json_response = response.json()
-            data = json_response.get("data", {})
+            data = self._get_interface(interface)
             ip_address = data.get("ipaddr")
             subnet = data.get("subnet")
             description = data.get("descr")
@@ -56,15 +216,12 @@ class PfSenseAPI:
             self.logger.error(f"Error getting interface details: {e}")
             raise e
 
+    @instrumented(API_SECONDS, API_CALLS, API_ERRORS)
     def get_dhcp_range(self, interface=None):
         if not interface:
             interface = self.interface
-        url = f"{self.base_url}/services/dhcp_server?id={interface}"
         try:
-            response = requests.get(url, headers=self._get_headers(), verify=self.verify_ssl)
-            response.raise_for_status()
-            json_response = response.json()
-            data = json_response.get("data", {})
+            data = self._get_dhcp_server(interface)
             range_from = data.get("range_from")
             range_to = data.get("range_to")
             return range_from, range_to
@@ -72,6 +229,48 @@ class PfSenseAPI:
             self.logger.error(f"Error getting DHCP range: {e}")
             raise e
 
+    def _build_snapshot(self, interface, dhcp_data, interface_data, fetched_at=None, version=4):
+        # DHCPv6 mappings carry ipaddrv6 and duid, and the interface its ipaddrv6/subnetv6
+        suffix = "v6" if version == 6 else ""
+        return InterfaceSnapshot(
+            interface=interface,
+            enabled=bool(dhcp_data.get("enable")),
+            mappings=dhcp_data.get("staticmap", []) or [],
+            range_from=dhcp_data.get("range_from"),
+            range_to=dhcp_data.get("range_to"),
+            ip_address=interface_data.get(f"ipaddr{suffix}"),
+            subnet=interface_data.get(f"subnet{suffix}"),
+            description=interface_data.get("descr"),
+            fetched_at=fetched_at,
+            version=version,
+        )
+
+    @instrumented(API_SECONDS, API_CALLS, API_ERRORS)
+    def get_interface_snapshot(self, interface=None, fresh=False, version=4):
+        """Returns an InterfaceSnapshot of one interface, from the mirror unless fresh is set."""
+        if not interface:
+            interface = self.interface
+        if self.mirror and not fresh:
+            self.mirror.ensure_sync(self)
+            snapshot = self.mirror.snapshot(self.base_url, interface, version, InterfaceSnapshot)
+            if snapshot:
+                return snapshot
+            # Not mirrored yet: read it from pfSense and mirror it
+            fresh = True
+        try:
+            # Only a fresh read says when pfSense was last seen; cached data may be older.
+            fetched_at = time.time() if fresh else None
+            dhcp_data = self._get_dhcp_server(interface, fresh, version)
+            interface_data = self._get_interface(interface, fresh)
+            snapshot = self._build_snapshot(interface, dhcp_data, interface_data, fetched_at, version)
+            if self.mirror and fresh:
+                self.mirror.sync(self.base_url, snapshot)
+            return snapshot
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Error getting interface snapshot for {interface}: {e}")
+            raise e
+
+    @instrumented(API_SECONDS, API_CALLS, API_ERRORS)
     def create_static_mapping(self, interface, mac_address, ip_address, hostname, description):
         url = f"{self.base_url}/services/dhcp_server/static_mapping"
         payload = {
@@ -95,52 +294,115 @@ class PfSenseAPI:
         headers["Content-Type"] = "application/json"
         
         try:
-            response = requests.post(url, headers=headers, json=payload, verify=self.verify_ssl)
+            response = self._send('POST', url, headers=headers, json=payload)
             response.raise_for_status()
-            return response.json()
+            self.invalidate_cache(interface)
+            result = response.json()
+            self._mirror_created(interface, 4, payload, result)
+            return result
         except requests.exceptions.RequestException as e:
             self.logger.error(f"Error creating static mapping: {e}")
             raise e
 
-    def apply_changes(self):
-        url = f"{self.base_url}/services/dhcp_server/apply"
+    @instrumented(API_SECONDS, API_CALLS, API_ERRORS)
+    def create_static_mapping_v6(self, interface, duid, ip_address, hostname, description):
+        url = f"{self._dhcp_url(6)}/static_mapping"
+        payload = {
+            "parent_id": interface,
+            "duid": duid,
+            "ipaddrv6": ip_address,
+            "hostname": hostname,
+            "domain": "",
+            "domainsearchlist": [""],
+            "descr": description
+        }
+        headers = self._get_headers()
+        headers["Content-Type"] = "application/json"
+
+        try:
+            response = self._send('POST', url, headers=headers, json=payload)
+            response.raise_for_status()
+            self.invalidate_cache(interface)
+            result = response.json()
+            self._mirror_created(interface, 6, payload, result)
+            return result
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Error creating DHCPv6 static mapping: {e}")
+            raise e
+
+    def _mirror_created(self, interface, version, payload, result):
+        """Adds a mapping pfSense reports as created to the mirror, preferring the stored copy pfSense returns."""
+        if not self.mirror or not result or result.get("status") != "ok":
+            return
+        data = result.get("data")
+        self.mirror.add(self.base_url, interface, version, data if isinstance(data, dict) and data else payload)
+
+    @instrumented(API_SECONDS, API_CALLS, API_ERRORS)
+    def apply_changes(self, version=4):
+        url = f"{self._dhcp_url(version)}/apply"
         headers = self._get_headers()
         headers["Content-Type"] = "application/json"
         try:
-            response = requests.post(url, headers=headers, json={}, verify=self.verify_ssl)
+            response = self._send('POST', url, headers=headers, json={})
             response.raise_for_status()
+            self.cache.invalidate(self._dhcp_url(version))
             return response.json()
         except requests.exceptions.RequestException as e:
             self.logger.error(f"Error applying changes: {e}")
             raise e
 
-    def get_available_interfaces(self):
+    @instrumented(API_SECONDS, API_CALLS, API_ERRORS)
+    def get_available_interfaces(self, fresh=False):
         url = f"{self.base_url}/interface/available_interfaces?limit=0&offset=0"
         try:
-            response = requests.get(url, headers=self._get_headers(), verify=self.verify_ssl)
-            response.raise_for_status()
-            json_response = response.json()
-            return json_response.get("data", [])
+            return self._get_data(url, self.topology_ttl, fresh, default=[])
         except requests.exceptions.RequestException as e:
             self.logger.error(f"Error getting available interfaces: {e}")
             raise e
 
+    @instrumented(API_SECONDS, API_CALLS, API_ERRORS)
     def get_dhcp_server_interfaces(self):
-        available_interfaces = self.get_available_interfaces()
-        dhcp_interfaces = []
-        for iface in available_interfaces:
-            interface_id = iface.get('in_use_by')
-            if not interface_id:
-                continue
-
-            url = f"{self.base_url}/services/dhcp_server?id={interface_id}"
-            try:
-                response = requests.get(url, headers=self._get_headers(), verify=self.verify_ssl)
-                if response.status_code == 200:
-                    json_response = response.json()
-                    data = json_response.get("data", {})
-                    if data.get('enable'):
-                        dhcp_interfaces.append(interface_id)
-            except requests.exceptions.RequestException as e:
-                self.logger.error(f"Error checking DHCP server for interface {interface_id}: {e}")
-        return dhcp_interfaces
+        return [snapshot.interface for snapshot in self.get_dhcp_interface_snapshots(include_details=False)]
+
+    def _fetch_dhcp_snapshot(self, interface_id, include_details, version=4, fresh=False):
+        """Returns (snapshot, ok): snapshot is None when the DHCP server is disabled or could not be read (ok is False)."""
+        try:
+            dhcp_data = self._get_dhcp_server(interface_id, fresh, version)
+            if not dhcp_data.get('enable'):
+                return None, True
+            interface_data = self._get_interface(interface_id, fresh) if include_details else {}
+            return self._build_snapshot(interface_id, dhcp_data, interface_data, time.time() if fresh else None, version), True
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Error checking DHCP server for interface {interface_id}: {e}")
+            return None, False
+
+    @instrumented(API_SECONDS, API_CALLS, API_ERRORS)
+    def get_dhcp_interface_snapshots(self, include_details=True, version=4, fresh=False):
+        """Returns InterfaceSnapshots of every interface with the DHCP (or, with version=6, DHCPv6) server enabled."""
+        if self.mirror and not fresh:
+            self.mirror.ensure_sync(self)
+            snapshots = self.mirror.snapshots(self.base_url, version, InterfaceSnapshot)
+            if snapshots is not None:
+                return snapshots
+            # Not mirrored yet: read everything from pfSense and mirror it
+            fresh = include_details = True
+
+        available_interfaces = self.get_available_interfaces(fresh)
+        interface_ids = [iface.get('in_use_by') for iface in available_interfaces if iface.get('in_use_by')]
+        results = []
+        if interface_ids:
+            workers = max(1, min(self.max_workers, len(interface_ids)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                tasks = [run_in_context(partial(self._fetch_dhcp_snapshot, interface_id, include_details, version, fresh))
+                         for interface_id in interface_ids]
+                results = list(executor.map(lambda task: task(), tasks))
+        snapshots = [snapshot for snapshot, _ in results if snapshot is not None]
+
+        # Only a complete read replaces the mirror; otherwise failed interfaces would vanish from it
+        if self.mirror and fresh and include_details:
+            if all(ok for _, ok in results):
+                self.mirror.sync_all(self.base_url, version, snapshots)
+            else:
+                for snapshot in snapshots:
+                    self.mirror.sync(self.base_url, snapshot)
+        return snapshots
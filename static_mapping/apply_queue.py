@@ -0,0 +1,155 @@
+import json
+import logging
+import time
+import uuid
+from .background import FirewallThread, FirewallThreads
+from .storage import SQLiteStore, shared_instance
+
+logger = logging.getLogger(__name__)
+
+# How often an idle worker looks for jobs queued by other processes or left behind by a dead one
+IDLE_POLL = 5.0
+
+
+class ApplyQueue(SQLiteStore):
+    """
+    Pending apply_changes calls, shared by every worker process on the host through a SQLite file.
+
+    Creating a mapping enqueues a job and returns its id straight away; a background thread per
+    firewall and process applies the changes. Jobs for the same firewall and DHCP version are
+    coalesced: the apply runs once no job has been added for `delay` seconds (or once the oldest
+    has waited max_delay seconds), and one apply completes every job queued until then, so a
+    burst of edits restarts DHCP once. Only one apply per firewall runs at a time, in any process.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id TEXT PRIMARY KEY, scope TEXT NOT NULL, firewall TEXT, interface TEXT, version INTEGER NOT NULL, "
+        "status TEXT NOT NULL, message TEXT, batch TEXT, "
+        "created_at REAL NOT NULL, started_at REAL, finished_at REAL)",
+        "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (scope, status, version)",
+    )
+
+    def __init__(self, path, delay=2, max_delay=10, stale_after=120, keep=3600):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.stale_after = stale_after
+        self.keep = keep
+        self._workers = FirewallThreads(ApplyWorker, self)
+        super().__init__(path)
+
+    def enqueue(self, pfsense_api, interface=None, version=4):
+        """Queues an apply of pfsense_api's DHCP (or, with version=6, DHCPv6) changes. Returns the job id."""
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, scope, firewall, interface, version, status, created_at) VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+                (job_id, pfsense_api.base_url, pfsense_api.name, interface, version, time.time()),
+            )
+        self.ensure_worker(pfsense_api).wake()
+        return job_id
+
+    def status(self, job_id):
+        """Returns a job as a dict (status is queued, running, done or failed), or None if it is unknown or expired."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, firewall, interface, version, status, message, batch, created_at, started_at, finished_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            job = dict(zip(('id', 'firewall', 'interface', 'version', 'status', 'message', 'batch', 'created_at',
+                            'started_at', 'finished_at'), row))
+            batch = job.pop('batch')
+            job['coalesced'] = conn.execute("SELECT COUNT(*) FROM jobs WHERE batch = ?", (batch,)).fetchone()[0] if batch else 0
+        return job
+
+    def ensure_worker(self, pfsense_api):
+        """Starts (once per firewall and process) the background thread that applies pfsense_api's queued jobs."""
+        return self._workers.ensure(pfsense_api)
+
+    def _claim(self, scope):
+        """
+        Marks every queued job of scope for the first DHCP version that is due as running under a new batch id.
+        Returns (batch, version, None) for a claimed batch, or (None, None, seconds) until the next check.
+        """
+        now = time.time()
+        with self._connect(immediate=True) as conn:
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - self.keep,))
+            # An apply that never finished belongs to a worker that died; applying again is harmless
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', batch = NULL, started_at = NULL "
+                "WHERE scope = ? AND status = 'running' AND started_at < ?",
+                (scope, now - self.stale_after),
+            )
+            if conn.execute("SELECT 1 FROM jobs WHERE scope = ? AND status = 'running' LIMIT 1", (scope,)).fetchone():
+                return None, None, self.delay
+            wait = None
+            rows = conn.execute(
+                "SELECT version, MIN(created_at), MAX(created_at) FROM jobs WHERE scope = ? AND status = 'queued' GROUP BY version",
+                (scope,),
+            ).fetchall()
+            for version, oldest, newest in rows:
+                due = min(newest + self.delay, oldest + self.max_delay)
+                if due <= now:
+                    batch = uuid.uuid4().hex
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', batch = ?, started_at = ? WHERE scope = ? AND version = ? AND status = 'queued'",
+                        (batch, now, scope, version),
+                    )
+                    return batch, version, None
+                wait = due - now if wait is None else min(wait, due - now)
+            return None, None, wait
+
+    def _finish(self, batch, ok, message):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, message = ?, finished_at = ? WHERE batch = ?",
+                ('done' if ok else 'failed', message, time.time(), batch),
+            )
+
+    def process(self, pfsense_api):
+        """
+        Runs every apply of pfsense_api's firewall that is due. Returns the seconds until the next
+        queued job is due, or None when nothing is queued.
+        """
+        while True:
+            batch, version, wait = self._claim(pfsense_api.base_url)
+            if batch is None:
+                return wait
+            try:
+                result = pfsense_api.apply_changes(version)
+                ok = bool(result and result.get("status") == "ok")
+                message = None if ok else json.dumps(result, indent=2) if result else "No response from apply API."
+            except Exception as e:
+                ok, message = False, str(e)
+            if ok:
+                logger.info(f"Applied DHCP{'v6' if version == 6 else ''} changes on {pfsense_api.base_url}.")
+            else:
+                logger.error(f"Failed to apply changes on {pfsense_api.base_url}: {message}")
+            self._finish(batch, ok, message)
+
+
+class ApplyWorker(FirewallThread):
+    """Applies one firewall's queued changes once they are due; woken early when a job is enqueued."""
+
+    interval = IDLE_POLL
+
+    def work(self):
+        wait = self.owner.process(self.pfsense_api)
+        return None if wait is None else min(wait, IDLE_POLL)
+
+
+def get_apply_queue(config):
+    """
+    Returns the process-wide ApplyQueue described by the [apply] section of config,
+    or None when changes should be applied synchronously instead.
+    """
+    if not config.getboolean('apply', 'background', fallback=True):
+        return None
+    path = config.get('apply', 'path', fallback='jobs.sqlite3')
+    delay = config.getfloat('apply', 'delay', fallback=2)
+    max_delay = config.getfloat('apply', 'max_delay', fallback=10)
+    stale_after = config.getfloat('apply', 'stale_after', fallback=120)
+    return shared_instance(ApplyQueue, path, delay, max_delay, stale_after)
@@ -0,0 +1,66 @@
+import abc
+import logging
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class FirewallThread(threading.Thread, metaclass=abc.ABCMeta):
+    """
+    Daemon thread that calls work() for one firewall every `interval` seconds, or sooner when
+    work() returns a shorter delay or wake() is called. The client it uses is in pfsense_api.
+    """
+
+    interval = 30.0
+
+    def __init__(self, owner, pfsense_api):
+        super().__init__(name=f"{type(self).__name__} {pfsense_api.base_url}", daemon=True)
+        self.owner = owner
+        self.pfsense_api = pfsense_api
+        self._event = threading.Event()
+
+    def wake(self):
+        self._event.set()
+
+    @abc.abstractmethod
+    def work(self):
+        """Does one round of work. Returns the seconds until the next round, or None for `interval`."""
+
+    def run(self):
+        delay = self.interval
+        while True:
+            self._event.wait(delay)
+            if sys.is_finalizing():
+                return
+            self._event.clear()
+            try:
+                delay = self.work()
+            except Exception as e:
+                logger.error(f"{self.name} failed: {e}")
+                delay = None
+            if delay is None:
+                delay = self.interval
+
+
+class FirewallThreads:
+    """Starts one thread_class(owner, pfsense_api) per firewall and process, on first use."""
+
+    def __init__(self, thread_class, owner):
+        self.thread_class = thread_class
+        self.owner = owner
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def ensure(self, pfsense_api):
+        """Returns the running thread for pfsense_api's firewall, starting it if needed."""
+        with self._lock:
+            thread = self._threads.get(pfsense_api.base_url)
+            if thread is None or not thread.is_alive():
+                thread = self.thread_class(self.owner, pfsense_api)
+                self._threads[pfsense_api.base_url] = thread
+                thread.start()
+            else:
+                # Follow the newest client, e.g. after the configuration was reloaded
+                thread.pfsense_api = pfsense_api
+        return thread
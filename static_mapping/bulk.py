@@ -0,0 +1,176 @@
+import csv
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from .api import PfSenseAPI
+from .config import load_config
+from .mapping_index import MAC_ADDRESS_RE
+from .reservations import get_ledger
+from .metrics import run_in_context
+
+FIELD_ALIASES = {
+    'mac': 'mac_address',
+    'mac_address': 'mac_address',
+    'hostname': 'hostname',
+    'description': 'description',
+    'descr': 'description',
+    'interface': 'interface',
+}
+
+def parse_rows(data, fmt):
+    """
+    Parses bulk input into a list of dicts with interface, mac_address, hostname and description keys.
+    fmt is 'csv' (with a header row) or 'json' (a list of objects).
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+
+    if fmt == 'json':
+        records = json.loads(data)
+        if not isinstance(records, list):
+            raise ValueError("JSON input must be a list of objects.")
+    elif fmt == 'csv':
+        try:
+            records = list(csv.DictReader(io.StringIO(data)))
+        except csv.Error as e:
+            raise ValueError(f"Invalid CSV: {e}")
+    else:
+        raise ValueError(f"Unsupported format '{fmt}'. Use 'csv' or 'json'.")
+
+    rows = []
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError("Each row must be an object with mac_address, hostname and description.")
+        row = {}
+        for key, value in record.items():
+            field = FIELD_ALIASES.get(str(key).strip().lower())
+            if field:
+                row[field] = str(value).strip() if value is not None else ''
+        rows.append(row)
+    return rows
+
+def _result(number, row, interface, status, message, ip_address=None):
+    return {
+        'row': number,
+        'interface': interface,
+        'mac_address': row.get('mac_address', ''),
+        'hostname': row.get('hostname', ''),
+        'ip_address': ip_address,
+        'status': status,
+        'message': message,
+    }
+
+def import_static_mappings(rows, logger, default_interface=None, config=None, pfsense_api=None, fleet=None):
+    """
+    Creates static mappings for many rows at once.
+
+    Every row is validated against one snapshot of each interface's mappings, IPs for the
+    whole batch are allocated in a single pass, mappings are created concurrently (bounded by
+    the [pfsense] max_workers option) and apply_changes is called once at the end.
+    With a FirewallFleet, rows whose MAC address or hostname exists on another firewall are rejected,
+    and so is every row when another firewall cannot be checked.
+    Returns (results, applied) where results has one dict per input row, in input order.
+    """
+    config = config or load_config()
+    pfsense_api = pfsense_api or PfSenseAPI(config, logger)
+    ledger = get_ledger(config)
+    other_snapshots, unchecked = fleet.other_snapshots(exclude=pfsense_api.name) if fleet else ([], {})
+
+    results = [None] * len(rows)
+    indexes = {}
+    pending = []
+
+    for number, row in enumerate(rows, start=1):
+        interface = row.get('interface') or default_interface or pfsense_api.interface
+        mac_address = row.get('mac_address', '')
+        hostname = row.get('hostname', '')
+        description = row.get('description', '')
+
+        if not mac_address or not hostname or not description:
+            results[number - 1] = _result(number, row, interface, 'error', 'MAC address, hostname and description are required.')
+            continue
+        if not MAC_ADDRESS_RE.match(mac_address):
+            results[number - 1] = _result(number, row, interface, 'error', 'Invalid MAC address format.')
+            continue
+
+        if interface not in indexes:
+            try:
+                indexes[interface] = pfsense_api.get_interface_snapshot(interface, fresh=True).index
+            except Exception as e:
+                indexes[interface] = None
+                logger.error(f"Could not load interface '{interface}' for bulk import: {e}")
+        index = indexes[interface]
+        if index is None or index.allocator is None:
+            results[number - 1] = _result(number, row, interface, 'error', f"Could not load interface '{interface}' from pfSense.")
+            continue
+
+        conflict = index.conflict(mac_address, hostname)
+        if not conflict and fleet:
+            conflict = fleet.find_conflict(mac_address, hostname, snapshots=other_snapshots, errors=unchecked)
+        if conflict:
+            results[number - 1] = _result(number, row, interface, 'error', conflict)
+            continue
+
+        if ledger:
+            next_ip, conflict = ledger.reserve(pfsense_api.base_url, interface, index, mac_address, hostname)
+            if conflict:
+                results[number - 1] = _result(number, row, interface, 'error', conflict)
+                continue
+        else:
+            next_ip = index.allocator.next_free()
+        if not next_ip:
+            results[number - 1] = _result(number, row, interface, 'error', 'Could not find an available IP address in the specified range.')
+            continue
+
+        # Record the row in the index now so later rows in the batch see it as taken
+        index.add({'mac': mac_address, 'hostname': hostname, 'ipaddr': next_ip})
+        pending.append((number, row, interface, next_ip))
+
+    def create(item):
+        number, row, interface, ip_address = item
+        if ledger and not ledger.renew(pfsense_api.base_url, [(interface, ip_address)]):
+            # Another worker may already have been given this address
+            return _result(number, row, interface, 'error', 'The reserved IP address expired before the mapping could be created. Please retry.')
+        try:
+            result = pfsense_api.create_static_mapping(interface, row['mac_address'], ip_address, row['hostname'], row['description'])
+        except Exception as e:
+            result, message = None, f"Failed to create static mapping: {e}"
+        else:
+            if result and result.get("status") == "ok":
+                if ledger:
+                    ledger.confirm(pfsense_api.base_url, interface, ip_address)
+                return _result(number, row, interface, 'created', 'Static mapping created.', ip_address)
+            message = f"Failed to create static mapping. Details: {json.dumps(result) if result else 'No response from API.'}"
+        if ledger:
+            ledger.release(pfsense_api.base_url, interface, ip_address)
+        return _result(number, row, interface, 'error', message, ip_address)
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(pfsense_api.max_workers, len(pending)))) as executor:
+            tasks = [run_in_context(partial(create, item)) for item in pending]
+            renewed = time.monotonic()
+            for position, (item, result) in enumerate(zip(pending, executor.map(lambda task: task(), tasks))):
+                results[item[0] - 1] = result
+                if ledger and time.monotonic() - renewed > ledger.ttl / 4:
+                    # A large batch can take longer than ttl; keep the rows still to be created reserved
+                    ledger.renew(pfsense_api.base_url, [(interface, ip_address) for _, _, interface, ip_address in pending[position + 1:]])
+                    renewed = time.monotonic()
+
+    created = [result for result in results if result['status'] == 'created']
+    applied = False
+    if created:
+        try:
+            apply_result = pfsense_api.apply_changes()
+            applied = bool(apply_result and apply_result.get("status") == "ok")
+        except Exception as e:
+            logger.error(f"Failed to apply changes after bulk import: {e}")
+        if applied:
+            logger.info(f"Bulk import created {len(created)} static mappings and applied changes.")
+        else:
+            logger.error(f"Bulk import created {len(created)} static mappings, but failed to apply changes.")
+            for result in created:
+                result['message'] = 'Static mapping created, but failed to apply changes.'
+
+    return results, applied
@@ -0,0 +1,116 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from .storage import SQLiteStore, shared_instance
+
+
+class MemoryCache:
+    """In-process TTL cache with LRU eviction. Shared by all threads of one worker."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached value, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, prefix):
+        """Drops every entry whose key starts with prefix."""
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache(SQLiteStore):
+    """
+    TTL cache with LRU eviction stored in a local SQLite file, so every gunicorn
+    worker on the host shares the same entries. Values must be JSON-serialisable.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS cache ("
+        "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)",
+    )
+    TIMEOUT = 5
+
+    def __init__(self, path, max_entries=1024):
+        self.max_entries = max_entries
+        super().__init__(path)
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        # Separate from the read, so a miss never takes the write lock and a read is never upgraded to a write
+        with self._connect() as conn:
+            if expires <= now:
+                conn.execute("DELETE FROM cache WHERE key = ? AND expires <= ?", (key, now))
+                return None
+            conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now),
+            )
+            conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def invalidate(self, prefix):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache")
+
+
+def get_cache(config):
+    """
+    Returns the process-wide cache described by the [cache] section of config.
+    backend = memory (default) keeps entries per worker; backend = sqlite shares them through a file.
+    """
+    backend = config.get('cache', 'backend', fallback='memory')
+    max_entries = config.getint('cache', 'max_entries', fallback=1024)
+    if backend == 'sqlite':
+        return shared_instance(SQLiteCache, config.get('cache', 'path', fallback='cache.sqlite3'), max_entries)
+    if backend == 'memory':
+        return shared_instance(MemoryCache, max_entries)
+    raise ValueError(f"Unknown cache backend '{backend}'. Use 'memory' or 'sqlite'.")
@@ -0,0 +1,115 @@
+import ipaddress
+import threading
+from collections import OrderedDict
+from .allocator import IPAllocator, mapping_ip
+from .metrics import instrumented, ALLOCATOR_SECONDS
+
+REPORT_FIELDS = ['firewall', 'interface', 'version', 'network', 'pool_size', 'free', 'used', 'utilisation',
+                 'largest_free_block', 'free_blocks', 'fragmentation', 'next_free_ip', 'in_pool', 'outside_subnet']
+
+# Summaries by snapshot ETag, which changes whenever the interface's mappings or settings do
+_summaries = OrderedDict()
+_summaries_lock = threading.Lock()
+MAX_CACHED_SUMMARIES = 4096
+
+
+def _pool_bounds(snapshot):
+    try:
+        return int(ipaddress.ip_address(snapshot.range_from)), int(ipaddress.ip_address(snapshot.range_to))
+    except ValueError:
+        return None
+
+
+@instrumented(ALLOCATOR_SECONDS)
+def summarize(snapshot):
+    """
+    Capacity summary of one InterfaceSnapshot, from a single pass over its mappings and its free ranges:
+
+    free and used count static mapping addresses outside the DHCP pool, largest_free_block is the
+    biggest run of consecutive free addresses (with its first address in largest_free_start), and
+    fragmentation is the share of free addresses outside that block (0 when the free space is one block).
+    in_pool and outside_subnet list mappings that sit inside the dynamic pool or outside the subnet.
+    Returns None when the interface lacks an IP, subnet or DHCP range.
+    """
+    if not snapshot.has_addressing:
+        return None
+    try:
+        allocator = IPAllocator.from_mappings(snapshot.mappings, snapshot.ip_address, snapshot.subnet,
+                                              snapshot.range_from, snapshot.range_to)
+    except ValueError:
+        return None
+    pool = _pool_bounds(snapshot)
+
+    used, in_pool, outside_subnet = set(), [], []
+    for mapping in snapshot.mappings:
+        ip = mapping_ip(mapping)
+        if not ip:
+            continue
+        entry = {'ipaddr': ip, 'mac': mapping.get('mac') or mapping.get('duid'), 'hostname': mapping.get('hostname')}
+        # None for malformed addresses and those of the other family
+        value = allocator.to_int(ip)
+        if value is None or not allocator.first_host <= value <= allocator.last_host:
+            outside_subnet.append(entry)
+        elif pool and pool[0] <= value <= pool[1]:
+            in_pool.append(entry)
+        else:
+            used.add(value)
+
+    free = free_blocks = largest = 0
+    largest_start = next_free = None
+    for start, end in allocator.free_ranges():
+        size = end - start + 1
+        free += size
+        free_blocks += 1
+        if next_free is None:
+            next_free = start
+        if size > largest:
+            largest, largest_start = size, start
+
+    return {
+        'interface': snapshot.interface,
+        'version': snapshot.version,
+        'network': str(allocator.network),
+        'pool_size': pool[1] - pool[0] + 1 if pool and pool[1] >= pool[0] else 0,
+        'free': free,
+        'used': len(used),
+        'utilisation': round(len(used) / (len(used) + free), 4) if used or free else 0.0,
+        'largest_free_block': largest,
+        'largest_free_start': allocator.to_address(largest_start) if largest_start is not None else None,
+        'free_blocks': free_blocks,
+        'fragmentation': round(1 - largest / free, 4) if free else 0.0,
+        'next_free_ip': allocator.to_address(next_free) if next_free is not None else None,
+        'in_pool': in_pool,
+        'outside_subnet': outside_subnet,
+    }
+
+
+def cached_summary(snapshot):
+    """summarize(snapshot), computed once per snapshot revision and then served from a process-wide cache."""
+    key = snapshot.etag
+    with _summaries_lock:
+        if key in _summaries:
+            _summaries.move_to_end(key)
+            return _summaries[key]
+    summary = summarize(snapshot)
+    with _summaries_lock:
+        _summaries[key] = summary
+        while len(_summaries) > MAX_CACHED_SUMMARIES:
+            _summaries.popitem(last=False)
+    return summary
+
+
+def capacity_report(fleet, version=4, names=None):
+    """
+    Returns (summaries, errors) for the DHCP (or, with version=6, DHCPv6) enabled interfaces of every
+    firewall in fleet, or only those in names. Each summary is a cached_summary() dict with its firewall
+    added; errors maps firewalls that did not respond to the reason.
+    """
+    results, errors = fleet.fan_out(lambda pfsense_api: pfsense_api.get_dhcp_interface_snapshots(version=version), names)
+    summaries = []
+    for name, snapshots in results.items():
+        for snapshot in snapshots:
+            summary = cached_summary(snapshot)
+            if summary is not None:
+                summaries.append(dict(summary, firewall=name))
+    return summaries, errors
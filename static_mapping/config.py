@@ -1,5 +1,8 @@
 import configparser
 import os
+import threading
+import time
+from .fleet import FirewallFleet
 
 def load_config(config_file='config.ini'):
     """Loads configuration from a .ini file."""
@@ -8,4 +11,64 @@ def load_config(config_file='config.ini'):
 
     config = configparser.ConfigParser()
     config.read(config_file)
-    return config
\ No newline at end of file
+    return config
+
+
+class ConfigStore:
+    """
+    Process-wide holder of the parsed configuration and the firewall clients built from it.
+
+    The file is re-read only when its modification time changes (checked at most every
+    check_interval seconds) or after reload() is called, e.g. from a SIGHUP handler.
+    """
+
+    def __init__(self, config_file='config.ini', logger=None, check_interval=2.0):
+        self.config_file = config_file
+        self.logger = logger
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._stale = False
+        self._load()
+
+    def _load(self):
+        self._mtime = os.stat(self.config_file).st_mtime
+        self._checked = time.monotonic()
+        self._config = load_config(self.config_file)
+        self._fleet = None
+        self._stale = False
+
+    def reload(self):
+        """Marks the configuration stale so the next access re-reads it. Safe to call from a signal handler."""
+        self._stale = True
+
+    def _refresh(self):
+        now = time.monotonic()
+        if not self._stale and now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.stat(self.config_file).st_mtime
+            except OSError:
+                return
+            if self._stale or mtime != self._mtime:
+                self._load()
+                if self.logger:
+                    self.logger.info(f"Reloaded configuration from '{self.config_file}'.")
+
+    @property
+    def config(self):
+        self._refresh()
+        return self._config
+
+    @property
+    def fleet(self):
+        """The shared FirewallFleet, with one PfSenseAPI client per firewall, rebuilt after the configuration changes."""
+        self._refresh()
+        fleet = self._fleet
+        if fleet is None:
+            with self._lock:
+                if self._fleet is None:
+                    self._fleet = FirewallFleet(self._config, self.logger)
+                fleet = self._fleet
+        return fleet
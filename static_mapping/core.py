@@ -1,53 +1,95 @@
 import json
 from .api import PfSenseAPI
-from .utils import find_next_available_ip, count_available_ips
 from .config import load_config
+from .mapping_index import normalize_duid
+from .reservations import get_ledger
 
-def create_static_mapping_entry(interface, mac_address, hostname, description, logger):
+def create_static_mapping_entry(interface, mac_address, hostname, description, logger, config=None, pfsense_api=None, fleet=None, duid=None, apply_queue=None):
     """
     Core logic to create a static mapping entry in pfSense.
-    Returns a tuple (success_status, message, available_ips_count).
+    config and pfsense_api default to a fresh load of config.ini and a client built from it.
+    If a FirewallFleet is given, the MAC address and hostname must also be unused on its other firewalls.
+    Pass a DHCPv6 client duid (mac_address may then be None) to create a DHCPv6 mapping instead.
+    With an ApplyQueue, the changes are applied in the background instead of before returning.
+    Returns a tuple (success_status, message, available_ips_count, apply_job_id); the job id is None
+    unless apply_queue was given.
     """
     try:
-        config = load_config()
-        pfsense_api = PfSenseAPI(config, logger)
+        config = config or load_config()
+        pfsense_api = pfsense_api or PfSenseAPI(config, logger)
+        version = 6 if duid else 4
+        if duid and normalize_duid(duid) is None:
+            return False, f"Error: Invalid DUID '{duid}'.", None, None
 
-        # Check for duplicate hostname or MAC address
-        existing_maps = pfsense_api.get_existing_static_mappings(interface)
-        for existing_map in existing_maps:
-            if existing_map.get('hostname') == hostname:
-                return False, f'Error: Hostname \'{hostname}\' already exists.', None
-            if existing_map.get('mac') == mac_address:
-                return False, f'Error: MAC Address \'{mac_address}\' already exists.', None
-
-        interface_ip, interface_subnet, _ = pfsense_api.get_interface_details(interface)
+        # Read past the cache so duplicate checks and allocation see the current mappings
+        snapshot = pfsense_api.get_interface_snapshot(interface, fresh=True, version=version)
 
-        dhcp_range_from, dhcp_range_to = pfsense_api.get_dhcp_range(interface)
+        # Check for duplicate hostname or MAC address
+        index = snapshot.index
+        conflict = index.conflict(mac_address, hostname, duid)
+        if conflict:
+            return False, f'Error: {conflict}', None, None
+        if fleet:
+            conflict = fleet.find_conflict(mac_address, hostname, exclude=pfsense_api.name, duid=duid, version=version)
+            if conflict:
+                return False, f'Error: {conflict}', None, None
 
-        next_ip = find_next_available_ip(existing_maps, interface_ip, interface_subnet, dhcp_range_from, dhcp_range_to)
+        # Reserve the address so concurrent workers allocating on this interface skip it
+        ledger = get_ledger(config)
+        # A dual-stack host has the same hostname in both, so DHCPv6 reservations are kept apart
+        scope = pfsense_api.base_url if version == 4 else f"{pfsense_api.base_url}#dhcpv6"
+        if not index.allocator:
+            next_ip = None
+        elif ledger:
+            next_ip, conflict = ledger.reserve(scope, interface, index, mac_address, hostname)
+            if conflict:
+                return False, f'Error: {conflict}', None, None
+        else:
+            next_ip = index.allocator.next_free()
 
         if next_ip:
-            result = pfsense_api.create_static_mapping(interface, mac_address, next_ip, hostname, description)
+            try:
+                if version == 6:
+                    result = pfsense_api.create_static_mapping_v6(interface, duid, next_ip, hostname, description)
+                else:
+                    result = pfsense_api.create_static_mapping(interface, mac_address, next_ip, hostname, description)
+            except Exception:
+                if ledger:
+                    ledger.release(scope, interface, next_ip)
+                raise
 
             if result and result.get("status") == "ok":
-                apply_result = pfsense_api.apply_changes()
+                if ledger:
+                    ledger.confirm(scope, interface, next_ip)
+                if version == 6:
+                    index.add({'duid': duid, 'hostname': hostname, 'ipaddrv6': next_ip})
+                else:
+                    index.add({'mac': mac_address, 'hostname': hostname, 'ipaddr': next_ip})
+                if apply_queue:
+                    job_id = apply_queue.enqueue(pfsense_api, interface, version)
+                    logger.info(f"Static mapping created for {'DUID' if duid else 'MAC'} {duid or mac_address} on interface {interface} with IP {next_ip}; apply queued as job {job_id}")
+                    message = "Static mapping created! 🎉 Changes are being applied in the background."
+                    return True, message, index.allocator.count_free(), job_id
+                apply_result = pfsense_api.apply_changes(version)
                 if apply_result and apply_result.get("status") == "ok":
-                    logger.info(f"Static mapping created for MAC {mac_address} on interface {interface} with IP {next_ip}")
+                    logger.info(f"Static mapping created for {'DUID' if duid else 'MAC'} {duid or mac_address} on interface {interface} with IP {next_ip}")
                     message = "Static mapping created and changes applied successfully! 🎉"
-                    available_ips_count = count_available_ips(existing_maps, interface_ip, interface_subnet, dhcp_range_from, dhcp_range_to)
-                    return True, message, available_ips_count
+                    available_ips_count = index.allocator.count_free()
+                    return True, message, available_ips_count, None
                 else:
                     message = "Static mapping created, but failed to apply changes. Details:\n" + (json.dumps(apply_result, indent=2) if apply_result else "No response from apply API.")
                     logger.error(f"Failed to apply changes: {message}")
-                    return False, message, None
+                    return False, message, None, None
             else:
+                if ledger:
+                    ledger.release(scope, interface, next_ip)
                 message = "Failed to create static mapping. Details:\n" + (json.dumps(result, indent=2) if result else "No response from API.")
                 logger.error(f"Failed to create static mapping: {message}")
-                return False, message, None
+                return False, message, None, None
         else:
             message = "Could not find an available IP address in the specified range. 😢"
-            return False, message, None
+            return False, message, None, None
 
     except Exception as e:
         logger.error(f"An unexpected error occurred: {e}")
-        return False, f"An unexpected error occurred: {e}", None
\ No newline at end of file
+        return False, f"An unexpected error occurred: {e}", None, None
\ No newline at end of file
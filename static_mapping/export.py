@@ -0,0 +1,97 @@
+import csv
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from .allocator import mapping_ip
+from .metrics import run_in_context
+
+EXPORT_FIELDS = ['firewall', 'interface', 'version', 'mac', 'duid', 'ipaddr', 'hostname', 'descr']
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def _interface_ids(pfsense_api, fresh, version):
+    if not fresh and pfsense_api.mirror:
+        # Only the DHCP-enabled interfaces, while the mirror has a current list of them
+        pfsense_api.mirror.ensure_sync(pfsense_api)
+        interfaces = pfsense_api.mirror.interfaces(pfsense_api.base_url, version)
+        if interfaces is not None:
+            return interfaces
+    # Disabled interfaces are dropped as their snapshots arrive
+    return [iface.get('in_use_by') for iface in pfsense_api.get_available_interfaces(fresh) if iface.get('in_use_by')]
+
+
+def iter_mapping_batches(fleet, version=4, fresh=False, errors=None, names=None):
+    """Yields a list of export rows per DHCP-enabled interface as it arrives; failures are appended to errors."""
+    listed, unreachable = fleet.fan_out(lambda pfsense_api: _interface_ids(pfsense_api, fresh, version), names)
+    if errors is not None:
+        errors.extend((name, None, message) for name, message in unreachable.items())
+
+    tasks = iter([(name, interface) for name, interface_ids in listed.items() for interface in interface_ids])
+    workers = max([1] + [fleet.get(name).max_workers for name in listed])
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = {}
+
+    def submit():
+        for name, interface in tasks:
+            read = partial(fleet.get(name).get_interface_snapshot, interface, fresh, version)
+            pending[executor.submit(run_in_context(read))] = (name, interface)
+            if len(pending) >= workers:
+                return
+
+    try:
+        submit()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, interface = pending.pop(future)
+                try:
+                    snapshot = future.result()
+                except Exception as e:
+                    if errors is not None:
+                        errors.append((name, interface, str(e)))
+                    continue
+                if not snapshot.enabled:
+                    continue
+                yield [{
+                    'firewall': name,
+                    'interface': interface,
+                    'version': version,
+                    'mac': mapping.get('mac') or '',
+                    'duid': mapping.get('duid') or '',
+                    'ipaddr': mapping_ip(mapping) or '',
+                    'hostname': mapping.get('hostname') or '',
+                    'descr': mapping.get('descr') or '',
+                } for mapping in snapshot.mappings]
+            submit()
+    finally:
+        # Also reached when the consumer stops early, e.g. a client disconnecting mid-download
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def csv_chunks(batches):
+    """Yields the CSV header, then the CSV lines of each batch of rows as one chunk."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, lineterminator='\n')
+    writer.writeheader()
+    yield buffer.getvalue()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(batches):
+    """Yields the rows of each batch as newline-delimited JSON, one chunk per batch."""
+    for rows in batches:
+        yield ''.join(json.dumps(row) + '\n' for row in rows)
+
+
+def export_chunks(batches, fmt):
+    """Formats batches from iter_mapping_batches as 'csv' or 'ndjson'. Raises ValueError for other formats."""
+    if fmt == 'csv':
+        return csv_chunks(batches)
+    if fmt == 'ndjson':
+        return ndjson_chunks(batches)
+    raise ValueError(f"Unsupported export format '{fmt}'. Use csv or ndjson.")
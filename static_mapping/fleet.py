@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+import logging
+import threading
+from .api import PfSenseAPI
+from .metrics import run_in_context
+
+FIREWALL_SECTION_PREFIX = 'firewall:'
+CONFLICT_LABELS = {'hostname': 'Hostname', 'mac': 'MAC Address', 'duid': 'DUID'}
+
+def firewall_sections(config):
+    """Returns (name, section) for every configured firewall; a lone [pfsense] section is named 'default'."""
+    sections = [(section[len(FIREWALL_SECTION_PREFIX):].strip(), section)
+                for section in config.sections() if section.startswith(FIREWALL_SECTION_PREFIX)]
+    return sections or [('default', 'pfsense')]
+
+def split_interface_id(interface_id, default_firewall):
+    """Splits a '<firewall>/<interface>' id; a bare interface belongs to default_firewall."""
+    if '/' in interface_id:
+        firewall, interface = interface_id.split('/', 1)
+        return firewall, interface
+    return default_firewall, interface_id
+
+
+class FirewallFleet:
+    """One PfSenseAPI client per configured firewall, queried concurrently for at most node_timeout seconds each."""
+
+    def __init__(self, config, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.node_timeout = config.getfloat('fleet', 'node_timeout', fallback=10)
+        self.firewalls = {}
+        self._stalled = {}
+        self._lock = threading.Lock()
+        for name, section in firewall_sections(config):
+            self.firewalls[name] = PfSenseAPI(config, logger, section=section, name=name)
+        self.unique_across_firewalls = config.getboolean('fleet', 'unique_across_firewalls', fallback=len(self.firewalls) > 1)
+
+    @property
+    def default(self):
+        return next(iter(self.firewalls.values()))
+
+    @property
+    def is_multi(self):
+        return len(self.firewalls) > 1
+
+    def interface_id(self, firewall, interface):
+        """Id of an interface in forms and URLs: '<firewall>/<interface>', or just the interface with a single firewall."""
+        return f"{firewall}/{interface}" if self.is_multi else interface
+
+    def get(self, name):
+        """Returns the client for a firewall by name; raises KeyError for an unknown name."""
+        try:
+            return self.firewalls[name]
+        except KeyError:
+            raise KeyError(f"Unknown firewall '{name}'.")
+
+    def fan_out(self, func, names=None):
+        """Returns (results, errors) of func(pfsense_api) on every firewall, keyed by firewall name."""
+        names = [name for name in self.firewalls if names is None or name in names]
+        results, errors = {}, {}
+        with self._lock:
+            for name in names:
+                stalled = self._stalled.get(name)
+                if stalled is not None and not stalled.done():
+                    errors[name] = "an earlier request has not finished yet"
+        pending = [name for name in names if name not in errors]
+        if not pending:
+            return results, errors
+
+        executor = ThreadPoolExecutor(max_workers=len(pending))
+        try:
+            futures = {name: executor.submit(run_in_context(partial(func, self.firewalls[name]))) for name in pending}
+            wait(futures.values(), timeout=self.node_timeout)
+            for name, future in futures.items():
+                if not future.done():
+                    errors[name] = f"timed out after {self.node_timeout:g}s"
+                    with self._lock:
+                        self._stalled[name] = future
+                elif future.exception() is not None:
+                    errors[name] = str(future.exception())
+                else:
+                    results[name] = future.result()
+        finally:
+            # Do not wait for firewalls that timed out; their threads finish in the background.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        for name, error in errors.items():
+            self.logger.error(f"Firewall '{name}' did not respond: {error}")
+        return {name: results[name] for name in names if name in results}, errors
+
+    def dhcp_interface_snapshots(self, include_details=True, version=4):
+        """Returns ([(firewall_name, snapshot), ...], errors) for the DHCP-enabled interfaces of every firewall."""
+        results, errors = self.fan_out(lambda pfsense_api: pfsense_api.get_dhcp_interface_snapshots(include_details, version))
+        snapshots = [(name, snapshot) for name, firewall_snapshots in results.items() for snapshot in firewall_snapshots]
+        return snapshots, errors
+
+    def other_snapshots(self, exclude=None, version=4):
+        """Returns ([(firewall_name, snapshot), ...], errors) for every firewall except exclude, or ([], {}) when the check is off."""
+        if not self.unique_across_firewalls:
+            return [], {}
+        names = [name for name in self.firewalls if name != exclude]
+
+        def read(pfsense_api):
+            _check_reachable(pfsense_api)
+            return pfsense_api.get_dhcp_interface_snapshots(False, version)
+
+        results, errors = self.fan_out(read, names)
+        return [(name, snapshot) for name, snapshots in results.items() for snapshot in snapshots], errors
+
+    def find_conflict(self, mac_address, hostname, exclude=None, snapshots=None, duid=None, version=4, errors=None):
+        """Returns why a new mapping clashes with, or cannot be checked against, the other firewalls, or None."""
+        if not self.unique_across_firewalls:
+            return None
+        if snapshots is None:
+            scopes = {pfsense_api.base_url: name for name, pfsense_api in self.firewalls.items() if name != exclude}
+            mirror = self.default.mirror
+            if mirror and mirror.is_fresh(scopes, version):
+                # Indexed lookups in the mirror instead of scanning every interface's mappings
+                _, errors = self.fan_out(_check_reachable, list(scopes.values()))
+                match = mirror.find_conflict(list(scopes), version, mac_address, hostname, duid)
+                if match is not None:
+                    scope, interface, field, value = match
+                    return f"{CONFLICT_LABELS[field]} '{value}' already exists on firewall '{scopes[scope]}', interface '{interface}'."
+                snapshots = []
+            else:
+                snapshots, errors = self.other_snapshots(exclude, version)
+        for name, snapshot in snapshots:
+            conflict = snapshot.index.conflict(mac_address, hostname, duid)
+            if conflict:
+                return f"{conflict.rstrip('.')} on firewall '{name}', interface '{snapshot.interface}'."
+        if errors:
+            unchecked = ', '.join(f"'{name}' ({error})" for name, error in errors.items())
+            return f"Could not check firewall {unchecked} for an existing {CONFLICT_LABELS['duid' if duid else 'mac']} or hostname."
+        return None
+
+
+def _check_reachable(pfsense_api):
+    # A live request: the mirror or cache can answer for a firewall that went down since it was last read
+    pfsense_api.get_available_interfaces(fresh=True)
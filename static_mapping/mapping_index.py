@@ -0,0 +1,121 @@
+import ipaddress
+import re
+from .allocator import IPAllocator, mapping_ip
+
+# The MAC address format accepted from users: six hex pairs separated by ':' or '-'
+MAC_ADDRESS_RE = re.compile(r'^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$')
+
+def normalize_mac(mac_address):
+    """Returns a MAC address as a 48-bit integer, accepting ':', '-' or '.' separators, or None if invalid."""
+    if not mac_address:
+        return None
+    digits = str(mac_address).strip().replace(':', '').replace('-', '').replace('.', '')
+    if len(digits) != 12:
+        return None
+    try:
+        return int(digits, 16)
+    except ValueError:
+        return None
+
+def normalize_duid(duid):
+    """Returns a DHCPv6 DUID as lowercase hex digits without separators, or None if invalid."""
+    if not duid:
+        return None
+    digits = str(duid).strip().replace(':', '').replace('-', '').lower()
+    if len(digits) < 4 or len(digits) % 2:
+        return None
+    try:
+        int(digits, 16)
+    except ValueError:
+        return None
+    return digits
+
+def normalize_ip(ip_address):
+    """
+    Returns IPv6 addresses in compressed form, so differently written forms of one address
+    compare equal. IPv4 addresses are returned as they are, which keeps bulk indexing cheap.
+    """
+    if ip_address and ':' in ip_address:
+        try:
+            return ipaddress.IPv6Address(ip_address).compressed
+        except ValueError:
+            return ip_address
+    return ip_address
+
+def normalize_hostname(hostname):
+    """Returns a hostname in the case-insensitive form used for duplicate checks."""
+    if not hostname:
+        return None
+    return str(hostname).strip().casefold()
+
+class MappingIndex:
+    """
+    O(1) lookups of static mappings by MAC (DUID for DHCPv6), hostname and IP, plus the
+    interval allocator for the same interface. Built once per snapshot and updated with add() as mappings
+    are created, so duplicate checks and allocation always agree.
+    """
+
+    def __init__(self, mappings=(), allocator=None, fetched_at=None):
+        self.allocator = allocator
+        self.fetched_at = fetched_at
+        self.by_mac = {}
+        self.by_duid = {}
+        self.by_hostname = {}
+        self.by_ip = {}
+        for mapping in mappings:
+            self._index(mapping)
+        # Addresses pfSense reported, as opposed to ones added locally since the snapshot
+        self.upstream_ips = set(self.by_ip)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        allocator = None
+        if snapshot.has_addressing:
+            try:
+                allocator = IPAllocator.from_mappings(snapshot.mappings, snapshot.ip_address, snapshot.subnet, snapshot.range_from, snapshot.range_to)
+            except ValueError:
+                allocator = None
+        return cls(snapshot.mappings, allocator, snapshot.fetched_at)
+
+    def _index(self, mapping):
+        mac = normalize_mac(mapping.get('mac'))
+        if mac is not None:
+            self.by_mac.setdefault(mac, mapping)
+        duid = normalize_duid(mapping.get('duid'))
+        if duid:
+            self.by_duid.setdefault(duid, mapping)
+        hostname = normalize_hostname(mapping.get('hostname'))
+        if hostname:
+            self.by_hostname.setdefault(hostname, mapping)
+        ip_address = normalize_ip(mapping_ip(mapping))
+        if ip_address:
+            self.by_ip.setdefault(ip_address, mapping)
+
+    def add(self, mapping):
+        """Records a newly created mapping and marks its IP as used."""
+        self._index(mapping)
+        ip_address = mapping_ip(mapping)
+        if self.allocator and ip_address:
+            self.allocator.mark_used(ip_address)
+
+    def find_by_mac(self, mac_address):
+        mac = normalize_mac(mac_address)
+        return self.by_mac.get(mac) if mac is not None else None
+
+    def find_by_duid(self, duid):
+        duid = normalize_duid(duid)
+        return self.by_duid.get(duid) if duid else None
+
+    def find_by_hostname(self, hostname):
+        hostname = normalize_hostname(hostname)
+        return self.by_hostname.get(hostname) if hostname else None
+
+    def conflict(self, mac_address, hostname, duid=None):
+        """Returns a message describing why a new mapping would be a duplicate, or None."""
+        if self.find_by_hostname(hostname) is not None:
+            return f"Hostname '{hostname}' already exists."
+        if mac_address and self.find_by_mac(mac_address) is not None:
+            return f"MAC Address '{mac_address}' already exists."
+        if duid and self.find_by_duid(duid) is not None:
+            return f"DUID '{duid}' already exists."
+        return None
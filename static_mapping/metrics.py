@@ -0,0 +1,160 @@
+import contextvars
+import functools
+import os
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def expose(self, extra=()):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(extra + key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, observations = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, observations + 1)
+
+    def expose(self, extra=()):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, observations) in sorted(self._values.items()):
+                key = extra + key
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(key + (('le', repr(bound)),))} {count}")
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', '+Inf'),))} {observations}")
+                lines.append(f"{self.name}_sum{_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_labels(key)} {observations}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(items):
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+UPSTREAM_REQUESTS = Counter('pfsense_upstream_requests_total', 'HTTP requests sent to the pfSense REST API.')
+UPSTREAM_ERRORS = Counter('pfsense_upstream_errors_total', 'pfSense REST API requests that failed or returned an error status.')
+UPSTREAM_SECONDS = Histogram('pfsense_upstream_request_seconds', 'Latency of pfSense REST API requests.')
+API_CALLS = Counter('pfsense_api_calls_total', 'Calls to PfSenseAPI methods.')
+API_ERRORS = Counter('pfsense_api_errors_total', 'PfSenseAPI method calls that raised an exception.')
+API_SECONDS = Histogram('pfsense_api_call_seconds', 'Latency of PfSenseAPI methods, including cache hits.')
+CACHE_REQUESTS = Counter('pfsense_cache_requests_total', 'Cached pfSense reads by result (hit or miss).')
+ALLOCATOR_SECONDS = Histogram('static_mapping_allocator_seconds', 'Time spent finding or counting available IPs.')
+HTTP_REQUEST_SECONDS = Histogram('http_request_seconds', 'Latency of web requests by Flask endpoint.')
+HTTP_UPSTREAM_CALLS = Histogram('http_request_upstream_calls', 'pfSense REST API calls made per web request.', buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+REGISTRY = [UPSTREAM_REQUESTS, UPSTREAM_ERRORS, UPSTREAM_SECONDS, API_CALLS, API_ERRORS, API_SECONDS, CACHE_REQUESTS,
+            ALLOCATOR_SECONDS, HTTP_REQUEST_SECONDS, HTTP_UPSTREAM_CALLS]
+
+# Mutable per-request tally of upstream calls. Worker threads started for a request must
+# run in a copy of the request's context (see run_in_context) to add to the same tally.
+_request_trace = contextvars.ContextVar('request_trace', default=None)
+
+
+def expose():
+    """
+    Returns every metric in the Prometheus text exposition format. Metrics are kept per process,
+    so every series carries a worker label with the process id; sum over it to combine workers.
+    """
+    extra = (('worker', str(os.getpid())),)
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose(extra))
+    return "\n".join(lines) + "\n"
+
+
+class RequestTrace:
+    """Upstream calls made while serving one request, possibly from several threads."""
+
+    def __init__(self):
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.upstream_calls += 1
+            self.upstream_seconds += seconds
+
+
+def start_trace():
+    trace = RequestTrace()
+    _request_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _request_trace.get()
+
+
+def run_in_context(func):
+    """Wraps func so it runs in a copy of the caller's context, e.g. when handed to a thread pool."""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, func)
+
+
+def record_upstream(firewall, method, endpoint, seconds, status=None, error=False):
+    UPSTREAM_REQUESTS.inc(firewall=firewall, method=method, endpoint=endpoint, status=status or 'none')
+    UPSTREAM_SECONDS.observe(seconds, firewall=firewall, method=method, endpoint=endpoint)
+    if error:
+        UPSTREAM_ERRORS.inc(firewall=firewall, method=method, endpoint=endpoint)
+    trace = _request_trace.get()
+    if trace is not None:
+        trace.add(seconds)
+
+
+def instrumented(histogram, counter=None, errors=None):
+    """Decorator recording call latency (and optionally call and error counts) with the function's name as a label."""
+    def decorator(func):
+        label_values = {'function': func.__name__}
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            if counter:
+                counter.inc(**label_values)
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                if errors:
+                    errors.inc(**label_values)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **label_values)
+        return wrapper
+    return decorator
@@ -0,0 +1,272 @@
+import hashlib
+import json
+import logging
+import time
+from .allocator import mapping_ip
+from .background import FirewallThread, FirewallThreads
+from .mapping_index import normalize_mac, normalize_duid, normalize_hostname, normalize_ip
+from .storage import SQLiteStore, shared_instance
+
+logger = logging.getLogger(__name__)
+
+
+def _slim(mapping, version):
+    """The fields of a pfSense static mapping this application uses; the rest are not mirrored."""
+    slim = {
+        'mac': mapping.get('mac'),
+        'duid': mapping.get('duid'),
+        'hostname': mapping.get('hostname'),
+        'descr': mapping.get('descr'),
+    }
+    slim['ipaddrv6' if version == 6 else 'ipaddr'] = mapping_ip(mapping)
+    return slim
+
+
+def _revision(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class MappingMirror(SQLiteStore):
+    """
+    Local copy of every firewall's DHCP and DHCPv6 static mappings in a SQLite file shared
+    by all workers, indexed by MAC, DUID, hostname and IP.
+
+    Reads on the request path are served from here while the copy of an interface is younger
+    than max_age seconds. A background thread per firewall re-syncs it from pfSense every
+    refresh_interval seconds, and mappings this application creates are added straight from
+    pfSense's response. Writes still confirm against a fresh read from pfSense first.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS interfaces ("
+        "scope TEXT NOT NULL, version INTEGER NOT NULL, interface TEXT NOT NULL, "
+        "enabled INTEGER NOT NULL, range_from TEXT, range_to TEXT, ip_address TEXT, subnet TEXT, "
+        "description TEXT, mappings TEXT NOT NULL, revision TEXT NOT NULL, synced_at REAL NOT NULL, "
+        "PRIMARY KEY (scope, version, interface))",
+        # One row per mapping for indexed lookups; the interfaces row holds them all as one JSON
+        # document, which loads far faster than a row at a time.
+        "CREATE TABLE IF NOT EXISTS mappings ("
+        "scope TEXT NOT NULL, version INTEGER NOT NULL, interface TEXT NOT NULL, "
+        "ipaddr TEXT, mac INTEGER, duid TEXT, hostname TEXT)",
+        "CREATE INDEX IF NOT EXISTS mappings_interface ON mappings (scope, version, interface, ipaddr)",
+        "CREATE INDEX IF NOT EXISTS mappings_mac ON mappings (mac)",
+        "CREATE INDEX IF NOT EXISTS mappings_duid ON mappings (duid)",
+        "CREATE INDEX IF NOT EXISTS mappings_hostname ON mappings (hostname)",
+        # When the list of DHCP-enabled interfaces of a firewall was last read in full,
+        # and when a background syncer last took on reading it
+        "CREATE TABLE IF NOT EXISTS syncs ("
+        "scope TEXT NOT NULL, version INTEGER NOT NULL, synced_at REAL NOT NULL, claimed_at REAL NOT NULL, "
+        "PRIMARY KEY (scope, version))",
+    )
+
+    def __init__(self, path, max_age=120, refresh_interval=30):
+        self.max_age = max_age
+        self.refresh_interval = refresh_interval
+        self._syncers = FirewallThreads(MirrorSyncer, self)
+        self._parsed = {}
+        super().__init__(path)
+
+    def _store(self, conn, scope, snapshot, now):
+        mappings = [_slim(mapping, snapshot.version) for mapping in snapshot.mappings]
+        conn.execute("DELETE FROM mappings WHERE scope = ? AND version = ? AND interface = ?",
+                     (scope, snapshot.version, snapshot.interface))
+        conn.executemany(
+            "INSERT INTO mappings (scope, version, interface, ipaddr, mac, duid, hostname) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [self._keys(scope, snapshot.version, snapshot.interface, mapping) for mapping in mappings],
+        )
+        settings = (snapshot.enabled, snapshot.range_from, snapshot.range_to, snapshot.ip_address, snapshot.subnet, snapshot.description)
+        # An upsert keeps the rowid, and with it the order pfSense lists the interfaces in
+        conn.execute(
+            "INSERT INTO interfaces (scope, version, interface, enabled, range_from, range_to, ip_address, subnet, "
+            "description, mappings, revision, synced_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (scope, version, interface) DO UPDATE SET enabled = excluded.enabled, range_from = excluded.range_from, "
+            "range_to = excluded.range_to, ip_address = excluded.ip_address, subnet = excluded.subnet, "
+            "description = excluded.description, mappings = excluded.mappings, revision = excluded.revision, "
+            "synced_at = excluded.synced_at",
+            (scope, snapshot.version, snapshot.interface, *settings, json.dumps(mappings), _revision(settings, mappings), now),
+        )
+
+    @staticmethod
+    def _keys(scope, version, interface, mapping):
+        return (scope, version, interface, normalize_ip(mapping_ip(mapping)), normalize_mac(mapping['mac']),
+                normalize_duid(mapping['duid']), normalize_hostname(mapping['hostname']))
+
+    def sync(self, scope, snapshot):
+        """Replaces the mirrored mappings and settings of one interface with a snapshot read from pfSense."""
+        with self._connect() as conn:
+            self._store(conn, scope, snapshot, time.time())
+
+    def sync_all(self, scope, version, snapshots):
+        """Replaces everything mirrored for one firewall and DHCP version with the DHCP-enabled interfaces in snapshots."""
+        now = time.time()
+        with self._connect() as conn:
+            interfaces = [snapshot.interface for snapshot in snapshots]
+            placeholders = ",".join("?" * len(interfaces))
+            for table in ("mappings", "interfaces"):
+                conn.execute(f"DELETE FROM {table} WHERE scope = ? AND version = ? AND interface NOT IN ({placeholders})",
+                             (scope, version, *interfaces))
+            for snapshot in snapshots:
+                self._store(conn, scope, snapshot, now)
+            conn.execute("INSERT OR REPLACE INTO syncs (scope, version, synced_at, claimed_at) VALUES (?, ?, ?, ?)",
+                         (scope, version, now, now))
+
+    def add(self, scope, interface, version, mapping):
+        """Records a mapping pfSense confirmed creating, without waiting for the next sync."""
+        mapping = _slim(mapping, version)
+        with self._connect(immediate=True) as conn:
+            row = conn.execute("SELECT mappings, revision FROM interfaces WHERE scope = ? AND version = ? AND interface = ?",
+                               (scope, version, interface)).fetchone()
+            if row is None:
+                return
+            mappings = json.loads(row[0])
+            mappings.append(mapping)
+            conn.execute("INSERT INTO mappings (scope, version, interface, ipaddr, mac, duid, hostname) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         self._keys(scope, version, interface, mapping))
+            conn.execute("UPDATE interfaces SET mappings = ?, revision = ? WHERE scope = ? AND version = ? AND interface = ?",
+                         (json.dumps(mappings), _revision(row[1], mapping), scope, version, interface))
+
+    def invalidate(self, scope):
+        """Forgets everything mirrored for one firewall, so the next read goes to pfSense."""
+        with self._connect() as conn:
+            for table in ("mappings", "interfaces", "syncs"):
+                conn.execute(f"DELETE FROM {table} WHERE scope = ?", (scope,))
+
+    def _load(self, conn, scope, version, revisions, snapshot_class):
+        """
+        Builds snapshots for (interface, revision) pairs. Parsed snapshots are kept per process and
+        reused while their revision is unchanged, so a request only decodes interfaces that changed.
+        Callers must treat the returned snapshots as read-only.
+        """
+        snapshots = []
+        for interface, revision in revisions:
+            key = (scope, version, interface)
+            snapshot = self._parsed.get(key)
+            if snapshot is None or snapshot.revision != revision:
+                row = conn.execute(
+                    "SELECT enabled, range_from, range_to, ip_address, subnet, description, mappings, revision FROM interfaces "
+                    "WHERE scope = ? AND version = ? AND interface = ?", key,
+                ).fetchone()
+                if row is None:
+                    continue
+                enabled, range_from, range_to, ip_address, subnet, description, mappings, revision = row
+                snapshot = snapshot_class(
+                    interface=interface, enabled=bool(enabled), mappings=json.loads(mappings), range_from=range_from,
+                    range_to=range_to, ip_address=ip_address, subnet=subnet, description=description, version=version,
+                    revision=revision,
+                )
+                self._parsed[key] = snapshot
+            snapshots.append(snapshot)
+        return snapshots
+
+    def snapshot(self, scope, interface, version, snapshot_class):
+        """Returns a snapshot_class built from the mirror, or None if the interface is not mirrored or too old."""
+        with self._connect() as conn:
+            revisions = conn.execute(
+                "SELECT interface, revision FROM interfaces WHERE scope = ? AND version = ? AND interface = ? AND synced_at > ?",
+                (scope, version, interface, time.time() - self.max_age),
+            ).fetchall()
+            snapshots = self._load(conn, scope, version, revisions, snapshot_class)
+        return snapshots[0] if snapshots else None
+
+    def snapshots(self, scope, version, snapshot_class):
+        """Returns snapshots of every mirrored DHCP-enabled interface, or None if the interface list is not mirrored or too old."""
+        with self._connect() as conn:
+            if not self._is_fresh(conn, scope, version):
+                return None
+            revisions = conn.execute(
+                "SELECT interface, revision FROM interfaces WHERE scope = ? AND version = ? AND enabled ORDER BY rowid",
+                (scope, version),
+            ).fetchall()
+            return self._load(conn, scope, version, revisions, snapshot_class)
+
+    def interfaces(self, scope, version):
+        """Names of the mirrored DHCP-enabled interfaces of scope in pfSense's order, or None if the list is not mirrored or too old."""
+        with self._connect() as conn:
+            if not self._is_fresh(conn, scope, version):
+                return None
+            return [interface for (interface,) in conn.execute(
+                "SELECT interface FROM interfaces WHERE scope = ? AND version = ? AND enabled ORDER BY rowid", (scope, version))]
+
+    def _is_fresh(self, conn, scope, version):
+        row = conn.execute("SELECT synced_at FROM syncs WHERE scope = ? AND version = ?", (scope, version)).fetchone()
+        return row is not None and row[0] > time.time() - self.max_age
+
+    def is_fresh(self, scopes, version):
+        """True when the interface lists of all scopes were synced within max_age seconds."""
+        with self._connect() as conn:
+            return all(self._is_fresh(conn, scope, version) for scope in scopes)
+
+    def find_conflict(self, scopes, version, mac_address=None, hostname=None, duid=None):
+        """
+        Looks up a MAC address, DUID or hostname among the mirrored mappings of scopes using the indexes.
+        Returns (scope, interface, field, value) for the first match, or None.
+        """
+        checks = [('hostname', normalize_hostname(hostname), hostname), ('mac', normalize_mac(mac_address), mac_address),
+                  ('duid', normalize_duid(duid), duid)]
+        placeholders = ",".join("?" * len(scopes))
+        with self._connect() as conn:
+            for column, key, value in checks:
+                if key is None or not scopes:
+                    continue
+                row = conn.execute(
+                    f"SELECT scope, interface FROM mappings WHERE {column} = ? AND version = ? AND scope IN ({placeholders}) LIMIT 1",
+                    (key, version, *scopes),
+                ).fetchone()
+                if row:
+                    return row[0], row[1], column, value
+        return None
+
+    def ensure_sync(self, pfsense_api):
+        """Starts (once per firewall and process) the background thread that keeps pfsense_api's mirror current."""
+        if self.refresh_interval > 0:
+            self._syncers.ensure(pfsense_api)
+
+    def versions(self, scope):
+        with self._connect() as conn:
+            return [version for (version,) in conn.execute("SELECT version FROM syncs WHERE scope = ?", (scope,))]
+
+    def claim_sync(self, scope, version):
+        """
+        True if this process should re-sync scope now. Every worker runs a syncer; whichever
+        claims a scope first does the work and the others skip it for this interval.
+        """
+        now = time.time()
+        with self._connect(immediate=True) as conn:
+            row = conn.execute("SELECT claimed_at FROM syncs WHERE scope = ? AND version = ?", (scope, version)).fetchone()
+            if row is not None and row[0] > now - self.refresh_interval * 0.9:
+                return False
+            if row is None:
+                conn.execute("INSERT INTO syncs (scope, version, synced_at, claimed_at) VALUES (?, ?, 0, ?)", (scope, version, now))
+            else:
+                conn.execute("UPDATE syncs SET claimed_at = ? WHERE scope = ? AND version = ?", (now, scope, version))
+            return True
+
+
+class MirrorSyncer(FirewallThread):
+    """Re-syncs one firewall's mirrored DHCP (and DHCPv6, once used) interfaces every refresh_interval seconds."""
+
+    def __init__(self, mirror, pfsense_api):
+        super().__init__(mirror, pfsense_api)
+        self.interval = mirror.refresh_interval
+
+    def work(self):
+        pfsense_api = self.pfsense_api
+        for version in self.owner.versions(pfsense_api.base_url) or [4]:
+            try:
+                if self.owner.claim_sync(pfsense_api.base_url, version):
+                    pfsense_api.get_dhcp_interface_snapshots(version=version, fresh=True)
+            except Exception as e:
+                logger.error(f"Background sync of {pfsense_api.base_url} failed: {e}")
+
+
+def get_mirror(config):
+    """
+    Returns the process-wide MappingMirror described by the [mirror] section of config,
+    or None when the mirror is disabled.
+    """
+    if not config.getboolean('mirror', 'enabled', fallback=True):
+        return None
+    path = config.get('mirror', 'path', fallback='mirror.sqlite3')
+    max_age = config.getfloat('mirror', 'max_age', fallback=120)
+    refresh_interval = config.getfloat('mirror', 'refresh_interval', fallback=30)
+    return shared_instance(MappingMirror, path, max_age, refresh_interval)
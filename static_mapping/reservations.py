@@ -0,0 +1,118 @@
+import time
+from .mapping_index import normalize_mac, normalize_hostname
+from .storage import SQLiteStore, shared_instance
+
+
+class ReservationLedger(SQLiteStore):
+    """
+    Short-lived IP reservations shared by every worker process on the host through a
+    SQLite file.
+
+    reserve() runs inside an immediate (write-locked) transaction, so two workers
+    allocating on the same firewall interface always get distinct addresses. The lock is
+    only held while picking an address, never across the pfSense round-trip.
+
+    A reservation expires after ttl seconds. Once its mapping is known to exist upstream,
+    either because the creator confirmed it or because a fresh snapshot contained it,
+    it is kept only for `grace` more seconds: long enough for workers holding snapshots
+    fetched before the mapping existed to still see it.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS reservations ("
+        "scope TEXT NOT NULL, interface TEXT NOT NULL, ipaddr TEXT NOT NULL, "
+        "mac INTEGER, hostname TEXT, expires REAL NOT NULL, "
+        "PRIMARY KEY (scope, interface, ipaddr))",
+    )
+
+    def __init__(self, path, ttl=120, grace=30):
+        self.ttl = ttl
+        self.grace = grace
+        super().__init__(path)
+
+    def reserve(self, scope, interface, index, mac_address, hostname):
+        """
+        Picks the next free IP from index.allocator that no other worker holds and reserves it.
+        scope identifies the firewall (its base URL). Returns (ip_address, conflict) where
+        conflict is a message if another pending reservation already uses the MAC or hostname.
+        """
+        now = time.time()
+        mac = normalize_mac(mac_address)
+        name = normalize_hostname(hostname)
+        with self._connect(immediate=True) as conn:
+            conn.execute("DELETE FROM reservations WHERE expires <= ?", (now,))
+            rows = conn.execute(
+                "SELECT ipaddr, mac, hostname FROM reservations WHERE scope = ? AND interface = ?",
+                (scope, interface),
+            ).fetchall()
+
+            for ipaddr, reserved_mac, reserved_hostname in rows:
+                if ipaddr in index.upstream_ips:
+                    # The mapping has reached pfSense and this snapshot already covers it.
+                    if index.fetched_at:
+                        conn.execute(
+                            "UPDATE reservations SET expires = MIN(expires, ?) "
+                            "WHERE scope = ? AND interface = ? AND ipaddr = ?",
+                            (index.fetched_at + self.grace, scope, interface, ipaddr),
+                        )
+                    continue
+                if name and reserved_hostname == name:
+                    return None, f"Hostname '{hostname}' is already being added."
+                if mac is not None and reserved_mac == mac:
+                    return None, f"MAC Address '{mac_address}' is already being added."
+                index.allocator.mark_used(ipaddr)
+
+            ip_address = index.allocator.next_free()
+            if ip_address:
+                conn.execute(
+                    "INSERT OR REPLACE INTO reservations (scope, interface, ipaddr, mac, hostname, expires) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (scope, interface, ip_address, mac, name, now + self.ttl),
+                )
+            return ip_address, None
+
+    def renew(self, scope, reservations):
+        """
+        Restarts the ttl of (interface, ip_address) reservations that have not expired, for callers
+        that hold reservations longer than ttl. Returns the set of those still held.
+        """
+        now = time.time()
+        held = set()
+        with self._connect(immediate=True) as conn:
+            for interface, ip_address in reservations:
+                updated = conn.execute(
+                    "UPDATE reservations SET expires = ? WHERE scope = ? AND interface = ? AND ipaddr = ? AND expires > ?",
+                    (now + self.ttl, scope, interface, ip_address, now),
+                ).rowcount
+                if updated:
+                    held.add((interface, ip_address))
+        return held
+
+    def confirm(self, scope, interface, ip_address):
+        """Marks a reservation as created upstream, so it only lingers for the grace period."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE reservations SET expires = MIN(expires, ?) WHERE scope = ? AND interface = ? AND ipaddr = ?",
+                (time.time() + self.grace, scope, interface, ip_address),
+            )
+
+    def release(self, scope, interface, ip_address):
+        """Drops a reservation whose mapping was not created."""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM reservations WHERE scope = ? AND interface = ? AND ipaddr = ?",
+                (scope, interface, ip_address),
+            )
+
+
+def get_ledger(config):
+    """
+    Returns the process-wide ReservationLedger described by the [reservations] section of config,
+    or None when reservations are disabled.
+    """
+    if not config.getboolean('reservations', 'enabled', fallback=True):
+        return None
+    path = config.get('reservations', 'path', fallback='reservations.sqlite3')
+    ttl = config.getfloat('reservations', 'ttl', fallback=120)
+    grace = config.getfloat('reservations', 'grace', fallback=30)
+    return shared_instance(ReservationLedger, path, ttl, grace)
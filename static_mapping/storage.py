@@ -0,0 +1,59 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SQLiteStore:
+    """
+    Base for state that every worker process on the host shares through one SQLite file in WAL
+    mode. Subclasses list the statements that create their tables and indexes in SCHEMA.
+    """
+
+    SCHEMA = ()
+    # Seconds a connection waits for another worker's write lock
+    TIMEOUT = 30
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.TIMEOUT)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                for statement in self.SCHEMA:
+                    conn.execute(statement)
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _connect(self, immediate=False):
+        """
+        Runs the block in one transaction on a new connection, committed on success. immediate takes
+        the write lock up front, so a read followed by a write cannot interleave with another worker's.
+        """
+        conn = sqlite3.connect(self.path, timeout=self.TIMEOUT, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def shared_instance(factory, *args):
+    """Returns the process-wide factory(*args), created on first use; one instance per distinct factory and arguments."""
+    key = (factory, args)
+    with _shared_lock:
+        instance = _shared.get(key)
+        if instance is None:
+            instance = factory(*args)
+            _shared[key] = instance
+        return instance
@@ -0,0 +1,197 @@
+"""
+Allocation guarantees: the interval allocator agrees with a host-by-host scan, and concurrent
+creations never hand out the same IP twice.
+"""
+import ipaddress
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.bench_allocator import build_case, legacy_count_available_ips, legacy_find_next_available_ip
+from benchmarks.fake_pfsense import FakePfSense
+from static_mapping.allocator import IPAllocator
+from static_mapping.api import InterfaceSnapshot
+from static_mapping.capacity import cached_summary
+from static_mapping.mapping_index import MappingIndex
+from static_mapping.reservations import ReservationLedger
+
+
+def allocator(cidr, used=(), pool=None):
+    network = ipaddress.ip_network(cidr, strict=False)
+    start, end = (ipaddress.ip_address(pool[0]), ipaddress.ip_address(pool[1])) if pool else (None, None)
+    return IPAllocator(network, start, end, used)
+
+
+def addresses(ranges):
+    return [(str(ipaddress.ip_address(start)), str(ipaddress.ip_address(end))) for start, end in ranges]
+
+
+@pytest.mark.parametrize("cidr", ["192.168.1.1/24", "10.0.0.1/22", "172.16.5.1/28", "10.1.0.1/30"])
+def test_matches_host_scan(cidr):
+    for mappings in (0, 3, 200):
+        args = build_case(cidr, mappings)
+        alloc = IPAllocator.from_mappings(*args)
+        assert alloc.next_free() == legacy_find_next_available_ip(*args)
+        assert alloc.count_free() == legacy_count_available_ips(*args)
+
+
+def test_mark_used_merges_touching_intervals():
+    alloc = allocator("10.0.0.0/24", used=["10.0.0.5", "10.0.0.7"])
+    assert addresses(alloc.free_ranges())[:3] == [("10.0.0.1", "10.0.0.4"), ("10.0.0.6", "10.0.0.6"), ("10.0.0.8", "10.0.0.254")]
+    alloc.mark_used("10.0.0.6")
+    assert addresses(alloc.free_ranges()) == [("10.0.0.1", "10.0.0.4"), ("10.0.0.8", "10.0.0.254")]
+    alloc.mark_used("10.0.0.4")
+    alloc.mark_used("10.0.0.8")
+    assert addresses(alloc.free_ranges()) == [("10.0.0.1", "10.0.0.3"), ("10.0.0.9", "10.0.0.254")]
+    assert alloc.count_free() == 254 - 5
+
+
+def test_pool_adjacent_to_mappings():
+    alloc = allocator("10.0.0.0/29", used=["10.0.0.1", "10.0.0.2"], pool=("10.0.0.3", "10.0.0.5"))
+    assert alloc.first_free(10) == ["10.0.0.6"]
+    alloc.mark_used("10.0.0.6")
+    assert alloc.next_free() is None
+    assert alloc.count_free() == 0
+
+
+def test_first_free_spans_ranges():
+    alloc = allocator("10.0.0.0/28", used=["10.0.0.2", "10.0.0.4"])
+    assert alloc.first_free(4) == ["10.0.0.1", "10.0.0.3", "10.0.0.5", "10.0.0.6"]
+    assert alloc.first_free(0) == []
+
+
+@pytest.mark.parametrize("cidr, hosts", [("10.0.0.0/31", ["10.0.0.0", "10.0.0.1"]), ("10.0.0.7/32", ["10.0.0.7"])])
+def test_point_to_point_networks_have_no_reserved_addresses(cidr, hosts):
+    alloc = allocator(cidr)
+    assert alloc.first_free(4) == hosts
+    for host in hosts:
+        alloc.mark_used(host)
+    assert alloc.next_free() is None
+    assert list(alloc.free_ranges()) == []
+
+
+def test_ipv6_slash_64():
+    network = ipaddress.ip_network("fd00:1::/64")
+    pool = (str(network[1 << 63]), str(network[-1]))
+    alloc = allocator("fd00:1::/64", used=["fd00:1::1", "fd00:1::2", "10.0.0.1", "not-an-ip"], pool=pool)
+    assert alloc.next_free() == "fd00:1::3"
+    assert alloc.count_free() == (1 << 63) - 3
+    alloc.mark_used("fd00:1::3")
+    assert alloc.first_free(2) == ["fd00:1::4", "fd00:1::5"]
+    assert addresses(alloc.free_ranges()) == [("fd00:1::4", str(network[(1 << 63) - 1]))]
+
+
+def test_capacity_matches_summary():
+    mappings = [{'mac': f'aa:bb:cc:00:00:{i:02x}', 'ipaddr': f'10.0.0.{i}'} for i in (2, 3, 150)]
+    snapshot = InterfaceSnapshot('lan', enabled=True, mappings=mappings, range_from='10.0.0.100', range_to='10.0.0.199',
+                                 ip_address='10.0.0.1', subnet=24)
+    summary = cached_summary(snapshot)
+    assert snapshot.capacity() == {'interface': 'lan', 'version': 4, 'free': summary['free'], 'used': 2,
+                                   'pool_size': 100, 'next_free_ip': '10.0.0.4'}
+    assert InterfaceSnapshot('wan').capacity()['free'] == 0
+
+
+def index_for(cidr, used=(), pool=None):
+    alloc = allocator(cidr, used, pool)
+    return MappingIndex([{"ipaddr": ip} for ip in used], alloc, fetched_at=None)
+
+
+def test_ledger_hands_out_distinct_addresses(tmp_path):
+    ledger = ReservationLedger(str(tmp_path / "ledger.sqlite3"))
+    # Each worker allocates from its own snapshot, which does not contain the others' mappings
+    first, conflict = ledger.reserve("fw", "opt1", index_for("10.0.0.0/29"), "02:00:00:00:00:01", "a")
+    second, _ = ledger.reserve("fw", "opt1", index_for("10.0.0.0/29"), "02:00:00:00:00:02", "b")
+    assert conflict is None
+    assert (first, second) == ("10.0.0.1", "10.0.0.2")
+    # Other interfaces and firewalls have their own address space
+    assert ledger.reserve("fw", "opt2", index_for("10.0.0.0/29"), "02:00:00:00:00:03", "c")[0] == "10.0.0.1"
+    assert ledger.reserve("other", "opt1", index_for("10.0.0.0/29"), "02:00:00:00:00:04", "d")[0] == "10.0.0.1"
+
+
+def test_ledger_rejects_pending_duplicates_and_releases(tmp_path):
+    ledger = ReservationLedger(str(tmp_path / "ledger.sqlite3"))
+    ip, _ = ledger.reserve("fw", "opt1", index_for("10.0.0.0/29"), "02:00:00:00:00:01", "host")
+    assert ledger.reserve("fw", "opt1", index_for("10.0.0.0/29"), "02-00-00-00-00-01", "other") == (None, "MAC Address '02-00-00-00-00-01' is already being added.")
+    assert ledger.reserve("fw", "opt1", index_for("10.0.0.0/29"), "02:00:00:00:00:02", "HOST")[1] == "Hostname 'HOST' is already being added."
+    ledger.release("fw", "opt1", ip)
+    assert ledger.reserve("fw", "opt1", index_for("10.0.0.0/29"), "02:00:00:00:00:02", "host") == (ip, None)
+
+
+def test_ledger_full_subnet(tmp_path):
+    ledger = ReservationLedger(str(tmp_path / "ledger.sqlite3"))
+    assert ledger.reserve("fw", "opt1", index_for("10.0.0.0/30"), "02:00:00:00:00:01", "a")[0] == "10.0.0.1"
+    assert ledger.reserve("fw", "opt1", index_for("10.0.0.0/30"), "02:00:00:00:00:02", "b")[0] == "10.0.0.2"
+    assert ledger.reserve("fw", "opt1", index_for("10.0.0.0/30"), "02:00:00:00:00:03", "c") == (None, None)
+
+
+def test_concurrent_creations_get_distinct_ips(tmp_path, monkeypatch):
+    from static_mapping.api import PfSenseAPI
+    from static_mapping.config import load_config
+    from static_mapping.core import create_static_mapping_entry
+
+    fake = FakePfSense(interfaces=1, mappings=10, prefix=24, latency=0.01)
+    fake.start()
+    try:
+        (tmp_path / "config.ini").write_text(fake.config_text(retries=0) +
+                                             f"\n[reservations]\npath = {tmp_path / 'reservations.sqlite3'}\n"
+                                             f"\n[mirror]\npath = {tmp_path / 'mirror.sqlite3'}\n")
+        monkeypatch.chdir(tmp_path)
+        config = load_config()
+        before = {mapping["ipaddr"] for mapping in fake.all_mappings()["opt1"]}
+
+        def worker(number):
+            # One client per thread, like separate gunicorn workers with their own caches
+            pfsense_api = PfSenseAPI(config, logging.getLogger("test"))
+            return [create_static_mapping_entry("opt1", f"0a:00:00:00:{number:02x}:{serial:02x}", f"stress-{number}-{serial}",
+                                                "stress test", logging.getLogger("test"), config, pfsense_api)[0]
+                    for serial in range(4)]
+
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            outcomes = [success for results in executor.map(worker, range(6)) for success in results]
+    finally:
+        fake.stop()
+
+    created = [mapping["ipaddr"] for mapping in fake.all_mappings()["opt1"] if mapping["ipaddr"] not in before]
+    assert all(outcomes)
+    assert len(created) == 24
+    assert len(set(created)) == len(created)
+
+
+def test_bulk_import_keeps_reservations_past_ttl(tmp_path, monkeypatch):
+    from static_mapping.api import PfSenseAPI
+    from static_mapping.bulk import import_static_mappings
+    from static_mapping.config import load_config
+    from static_mapping.reservations import get_ledger
+
+    fake = FakePfSense(interfaces=1, mappings=10, prefix=24, latency=0.05)
+    fake.start()
+    try:
+        (tmp_path / "config.ini").write_text(fake.config_text(retries=0, max_workers=2) + "\n[mirror]\nenabled = false\n"
+                                             f"\n[reservations]\npath = {tmp_path / 'reservations.sqlite3'}\nttl = 0.5\n")
+        monkeypatch.chdir(tmp_path)
+        config = load_config()
+        ledger = get_ledger(config)
+        pfsense_api = PfSenseAPI(config, logging.getLogger("test"))
+        other = PfSenseAPI(config, logging.getLogger("test"))
+        handed_out = []
+        create = pfsense_api.create_static_mapping
+
+        def create_while_another_worker_allocates(interface, *args):
+            # Another worker reading pfSense now does not see the rows of the batch still to be created
+            index = other.get_interface_snapshot(interface, fresh=True).index
+            ip, _ = ledger.reserve(other.base_url, interface, index, None, None)
+            ledger.release(other.base_url, interface, ip)
+            handed_out.append(ip)
+            return create(interface, *args)
+
+        monkeypatch.setattr(pfsense_api, "create_static_mapping", create_while_another_worker_allocates)
+        rows = [{"mac_address": f"0a:00:00:00:01:{number:02x}", "hostname": f"bulk-{number}", "description": "d"} for number in range(20)]
+        results, _ = import_static_mappings(rows, logging.getLogger("test"), "opt1", config, pfsense_api)
+    finally:
+        fake.stop()
+
+    assigned = {result["ip_address"] for result in results}
+    assert [result["status"] for result in results] == ["created"] * 20
+    assert len(assigned) == 20
+    assert not assigned & set(handed_out)
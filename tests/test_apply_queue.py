@@ -0,0 +1,67 @@
+"""A burst of creations is applied once, and every job reports how its apply went."""
+import time
+
+import pytest
+
+from static_mapping.apply_queue import ApplyQueue
+
+
+class Firewall:
+    """Stands in for PfSenseAPI: counts apply_changes calls and answers with result (or raises it)."""
+
+    def __init__(self, result):
+        self.base_url = "http://firewall/api/v2"
+        self.name = "default"
+        self.result = result
+        self.applies = []
+
+    def apply_changes(self, version=4):
+        self.applies.append(version)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def wait_for(queue, job_ids, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        jobs = [queue.status(job_id) for job_id in job_ids]
+        if all(job["status"] in ("done", "failed") for job in jobs):
+            return jobs
+        time.sleep(0.05)
+    pytest.fail(f"jobs still pending: {jobs}")
+
+
+def test_burst_is_applied_once(tmp_path):
+    queue = ApplyQueue(str(tmp_path / "jobs.sqlite3"), delay=0.3, max_delay=5)
+    firewall = Firewall({"status": "ok"})
+    job_ids = [queue.enqueue(firewall, "opt1") for _ in range(5)]
+    assert queue.status(job_ids[0])["status"] == "queued"
+
+    jobs = wait_for(queue, job_ids)
+    assert firewall.applies == [4]
+    assert [job["status"] for job in jobs] == ["done"] * 5
+    assert [job["coalesced"] for job in jobs] == [5] * 5
+    assert queue.status("unknown") is None
+
+
+def test_versions_are_applied_separately(tmp_path):
+    queue = ApplyQueue(str(tmp_path / "jobs.sqlite3"), delay=0.1, max_delay=5)
+    firewall = Firewall({"status": "ok"})
+    jobs = wait_for(queue, [queue.enqueue(firewall, "opt1", 4), queue.enqueue(firewall, "opt1", 6)])
+    assert sorted(firewall.applies) == [4, 6]
+    assert [job["coalesced"] for job in jobs] == [1, 1]
+
+
+@pytest.mark.parametrize("result, message", [
+    ({"status": "error", "message": "Config locked"}, "Config locked"),
+    (None, "No response from apply API."),
+    (ConnectionError("unreachable"), "unreachable"),
+])
+def test_failed_apply_is_reported(tmp_path, result, message):
+    queue = ApplyQueue(str(tmp_path / "jobs.sqlite3"), delay=0.1, max_delay=5)
+    firewall = Firewall(result)
+    jobs = wait_for(queue, [queue.enqueue(firewall, "opt1") for _ in range(2)])
+    assert len(firewall.applies) == 1
+    assert [job["status"] for job in jobs] == ["failed", "failed"]
+    assert message in jobs[0]["message"]
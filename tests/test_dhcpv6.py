@@ -0,0 +1,76 @@
+"""DHCPv6 mappings can be created from the core function and the web form, keyed by the client DUID."""
+import logging
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from benchmarks.fake_pfsense import FakePfSense
+from static_mapping.config import load_config
+from static_mapping.core import create_static_mapping_entry
+
+logger = logging.getLogger("test")
+DUID = "00:01:00:01:2a:3b:4c:5d:0a:00:00:00:00:01"
+
+
+def configure(fake, tmp_path, monkeypatch):
+    (tmp_path / "config.ini").write_text(
+        fake.config_text(retries=0) + f"\n[mirror]\npath = {tmp_path / 'mirror.sqlite3'}\nrefresh_interval = 0\n"
+        f"[reservations]\npath = {tmp_path / 'reservations.sqlite3'}\n[apply]\nbackground = false\n"
+        f"[auth]\nusername = admin\npassword_hash = {generate_password_hash('pw')}\n")
+    monkeypatch.chdir(tmp_path)
+    return load_config()
+
+
+@pytest.fixture
+def fake():
+    fake = FakePfSense(interfaces=2, mappings=3, ipv6=True)
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+def client(config):
+    from web import create_app
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+    client = app.test_client()
+    client.post("/login", data={"username": "admin", "password": "pw"})
+    return client
+
+
+def test_create_with_duid(fake, tmp_path, monkeypatch):
+    config = configure(fake, tmp_path, monkeypatch)
+    success, message, free, _ = create_static_mapping_entry("opt1", None, "v6-host", "d", logger, config, duid=DUID)
+    assert success, message
+    created = fake.dhcpv6["opt1"]["staticmap"][-1]
+    assert (created["duid"], created["hostname"], created["ipaddrv6"]) == (DUID, "v6-host", "fd00::5")
+    assert len(fake.dhcp["opt1"]["staticmap"]) == 3
+    assert fake.calls[("POST", "/api/v2/services/dhcpv6_server/apply")] == 1
+
+    success, message, _, _ = create_static_mapping_entry("opt1", None, "other", "d", logger, config, duid=DUID.upper())
+    assert not success
+    assert "DUID" in message
+
+
+def test_form_creates_dhcpv6_mapping(fake, tmp_path, monkeypatch):
+    web = client(configure(fake, tmp_path, monkeypatch))
+    response = web.post("/", data={"interface": "opt2", "hostname": "v6-form", "description": "d", "duid": DUID},
+                        follow_redirects=True)
+    assert "Static mapping created" in response.text
+    assert fake.dhcpv6["opt2"]["staticmap"][-1]["duid"] == DUID
+
+    response = web.post("/", data={"interface": "opt2", "hostname": "neither", "description": "d"})
+    assert "Enter a MAC address, or a DUID" in response.text
+    assert fake.dhcpv6["opt2"]["staticmap"][-1]["hostname"] == "v6-form"
+
+
+def test_capacity_without_dhcpv6_server_is_not_found(tmp_path, monkeypatch):
+    fake = FakePfSense(interfaces=1, mappings=3)
+    fake.start()
+    try:
+        web = client(configure(fake, tmp_path, monkeypatch))
+        assert web.get("/api/interfaces/opt1/capacity").status_code == 200
+        assert web.get("/api/interfaces/opt1/capacity?version=6").status_code == 404
+        assert web.get("/api/interfaces/opt1/mappings?version=6").status_code == 404
+    finally:
+        fake.stop()
@@ -0,0 +1,65 @@
+"""The export streams every DHCP-enabled interface and, unless asked to be fresh, reads only the mirror."""
+import ipaddress
+import json
+import logging
+
+from benchmarks.fake_pfsense import FakePfSense
+from static_mapping.config import load_config
+from static_mapping.export import export_chunks, iter_mapping_batches
+from static_mapping.fleet import FirewallFleet
+
+
+def test_export_reads_mirror_and_skips_disabled_interfaces(tmp_path, monkeypatch):
+    fake = FakePfSense(interfaces=3, mappings=4)
+    subnets = ipaddress.ip_network("172.16.0.0/16").subnets(new_prefix=24)
+    for number in range(5):
+        fake.add_interface(f"off{number}", next(subnets), mappings=2, enable=False)
+    fake.start()
+    try:
+        (tmp_path / "config.ini").write_text(fake.config_text() + f"\n[mirror]\npath = {tmp_path / 'mirror.sqlite3'}\nrefresh_interval = 0\n")
+        monkeypatch.chdir(tmp_path)
+        fleet = FirewallFleet(load_config(), logging.getLogger("test"))
+        errors = []
+        first = "".join(export_chunks(iter_mapping_batches(fleet, errors=errors), "ndjson"))
+        # What the background syncer does every refresh_interval
+        fleet.default.get_dhcp_interface_snapshots(fresh=True)
+        calls = sum(fake.calls.values())
+        second = "".join(export_chunks(iter_mapping_batches(fleet, errors=errors), "ndjson"))
+        upstream = sum(fake.calls.values()) - calls
+        fresh = "".join(export_chunks(iter_mapping_batches(fleet, fresh=True, errors=errors), "ndjson"))
+    finally:
+        fake.stop()
+
+    rows = [json.loads(line) for line in second.splitlines()]
+    assert upstream == 0
+    assert errors == []
+    assert sorted(first.splitlines()) == sorted(second.splitlines())
+    assert sorted(fresh.splitlines()) == sorted(second.splitlines())
+    assert len(rows) == 12
+    assert {row["interface"] for row in rows} == {"opt1", "opt2", "opt3"}
+
+
+def test_export_without_mirror_streams_from_first_interface(tmp_path, monkeypatch):
+    fake = FakePfSense(interfaces=20, mappings=10)
+    fake.add_interface("off0", ipaddress.ip_network("172.16.0.0/24"), mappings=2, enable=False)
+    fake.start()
+    try:
+        (tmp_path / "config.ini").write_text(fake.config_text(max_workers=4) + "\n[mirror]\nenabled = false\n")
+        monkeypatch.chdir(tmp_path)
+        fleet = FirewallFleet(load_config(), logging.getLogger("test"))
+        reads = lambda: sum(count for (method, path), count in fake.calls.items() if path.endswith("/dhcp_server"))
+        errors = []
+        batches = iter_mapping_batches(fleet, errors=errors)
+        first = next(batches)
+        before_first = reads()
+        rows = first + [row for batch in batches for row in batch]
+        total = reads()
+    finally:
+        fake.stop()
+
+    assert errors == []
+    # Only the reads already in flight, not a listing pass over every interface's full document
+    assert before_first <= 4
+    assert total == 21
+    assert len(rows) == 200
+    assert "off0" not in {row["interface"] for row in rows}
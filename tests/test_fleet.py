@@ -0,0 +1,59 @@
+"""The cross-firewall uniqueness check must refuse writes it cannot fully verify."""
+import logging
+
+import pytest
+
+from benchmarks.fake_pfsense import FakePfSense, config_text
+from static_mapping.bulk import import_static_mappings
+from static_mapping.config import load_config
+from static_mapping.core import create_static_mapping_entry
+from static_mapping.fleet import FirewallFleet
+
+logger = logging.getLogger("test")
+
+
+@pytest.fixture(params=[False, True], ids=["no-mirror", "mirror"])
+def fleet(request, tmp_path, monkeypatch):
+    a, b = FakePfSense(interfaces=2, mappings=3), FakePfSense(interfaces=1, mappings=3)
+    a.start(), b.start()
+    sections = []
+    for name, fake in (("a", a), ("b", b)):
+        sections.append(config_text(fake.port, "opt1", retries=0).replace("[pfsense]", f"[firewall:{name}]"))
+    mirror = f"enabled = true\npath = {tmp_path / 'mirror.sqlite3'}\nrefresh_interval = 0" if request.param else "enabled = false"
+    (tmp_path / "config.ini").write_text("\n".join(sections) + f"\n[fleet]\nnode_timeout = 2\n[mirror]\n{mirror}\n"
+                                         f"[reservations]\npath = {tmp_path / 'reservations.sqlite3'}\n")
+    monkeypatch.chdir(tmp_path)
+    config = load_config()
+    fleet = FirewallFleet(config, logger)
+    if request.param:
+        # What a page view or the background syncer leaves behind: a mirror that answers without pfSense
+        for pfsense_api in fleet.firewalls.values():
+            pfsense_api.get_dhcp_interface_snapshots(fresh=True)
+        assert fleet.default.mirror.is_fresh([pfsense_api.base_url for pfsense_api in fleet.firewalls.values()], 4)
+    yield config, fleet, a, b
+    a.stop()
+    b.stop()
+
+
+def test_duplicate_on_other_firewall_is_rejected(fleet):
+    config, fleet, a, b = fleet
+    success, message, _, _ = create_static_mapping_entry("opt2", "0a:00:00:00:00:01", "opt1-host0", "d", logger,
+                                                         config, fleet.get("a"), fleet)
+    assert not success
+    assert "firewall 'b'" in message
+
+
+def test_unreachable_firewall_blocks_writes(fleet):
+    config, fleet, a, b = fleet
+    b.stop()
+    before = len(a.all_mappings()["opt2"])
+    success, message, _, _ = create_static_mapping_entry("opt2", "0a:00:00:00:00:01", "brand-new", "d", logger,
+                                                         config, fleet.get("a"), fleet)
+    assert not success
+    assert "Could not check firewall 'b'" in message
+
+    results, _ = import_static_mappings([{"mac_address": "0a:00:00:00:00:02", "hostname": "new", "description": "d"}], logger,
+                                        default_interface="opt2", config=config, pfsense_api=fleet.get("a"), fleet=fleet)
+    assert results[0]["status"] == "error"
+    assert "Could not check firewall 'b'" in results[0]["message"]
+    assert len(a.all_mappings()["opt2"]) == before
@@ -0,0 +1,27 @@
+"""Snapshots served from the mirror must look exactly like the ones read from pfSense."""
+import logging
+
+from benchmarks.fake_pfsense import FakePfSense
+from static_mapping.api import PfSenseAPI
+from static_mapping.config import load_config
+
+
+def test_mirrored_snapshot_matches_fresh_read(tmp_path, monkeypatch):
+    fake = FakePfSense(interfaces=2, mappings=5)
+    fake.start()
+    try:
+        (tmp_path / "config.ini").write_text(fake.config_text() + f"\n[mirror]\npath = {tmp_path / 'mirror.sqlite3'}\nrefresh_interval = 0\n")
+        monkeypatch.chdir(tmp_path)
+        pfsense_api = PfSenseAPI(load_config(), logging.getLogger("test"))
+        fresh = pfsense_api.get_dhcp_interface_snapshots(fresh=True)
+        calls = sum(fake.calls.values())
+        mirrored = pfsense_api.get_dhcp_interface_snapshots()
+    finally:
+        fake.stop()
+
+    assert sum(fake.calls.values()) == calls
+    assert [snapshot.revision for snapshot in mirrored] != [None, None]
+    for before, after in zip(fresh, mirrored):
+        assert (after.interface, after.ip_address, after.subnet, after.range_from, after.range_to, after.description) == \
+               (before.interface, before.ip_address, before.subnet, before.range_from, before.range_to, before.description)
+        assert type(after.subnet) is type(before.subnet) is int
@@ -1,9 +1,11 @@
 import os
+import signal
 from flask import Flask
 from flask_wtf.csrf import CSRFProtect
 from datetime import timedelta
 import logging
 from logging.handlers import RotatingFileHandler
+from static_mapping.config import ConfigStore
 
 def create_app():
     app = Flask(__name__)
@@ -22,11 +24,30 @@ def create_app():
     app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=2)
     csrf = CSRFProtect(app)
 
+    # One parsed config and pfSense client per process; re-read when config.ini changes or on SIGHUP
+    config_store = ConfigStore('config.ini', app.logger)
+    app.extensions['config_store'] = config_store
+    if hasattr(signal, 'SIGHUP'):
+        try:
+            signal.signal(signal.SIGHUP, lambda signum, frame: config_store.reload())
+        except ValueError:
+            # Not the main thread (e.g. some test runners); mtime checks still apply.
+            pass
+
     with app.app_context():
         from . import auth
         from . import views
+        from . import api
+        from . import metrics
+        from . import export
 
         app.register_blueprint(auth.auth_bp)
         app.register_blueprint(views.views_bp)
+        app.register_blueprint(api.api_bp)
+        app.register_blueprint(metrics.metrics_bp)
+        app.register_blueprint(export.export_bp)
+
+        app.before_request(metrics.start_request_trace)
+        app.after_request(metrics.finish_request_trace)
 
     return app
\ No newline at end of file
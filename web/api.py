@@ -0,0 +1,113 @@
+import hashlib
+import json
+import requests
+from flask import Blueprint, jsonify, request, abort
+from static_mapping.allocator import mapping_ip
+from web.auth import login_required
+from static_mapping.apply_queue import get_apply_queue
+from static_mapping.capacity import capacity_report
+from web.pfsense import get_config, get_fleet, resolve_interface
+
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+def _conditional_json(payload, etag, errors=None):
+    """
+    Returns payload as JSON, or 304 Not Modified if the client already has this ETag.
+    errors maps firewalls that did not respond to the reason; they are listed in X-Unreachable-Firewalls.
+    """
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    if errors:
+        response.headers['X-Unreachable-Firewalls'] = ', '.join(sorted(errors))
+    return response.make_conditional(request)
+
+def _version():
+    """The DHCP version asked for with ?version=6 (DHCPv6); 4 by default."""
+    version = request.args.get('version', 4, type=int)
+    if version not in (4, 6):
+        abort(400)
+    return version
+
+def _payload_etag(payload, errors):
+    return hashlib.sha1(json.dumps([payload, sorted(errors)], sort_keys=True).encode()).hexdigest()
+
+@api_bp.route('/interfaces')
+@login_required
+def interfaces():
+    fleet = get_fleet()
+    snapshots, errors = fleet.dhcp_interface_snapshots(version=_version())
+    payload = [{
+        'id': fleet.interface_id(firewall, snapshot.interface),
+        'firewall': firewall,
+        'interface': snapshot.interface,
+        'description': snapshot.description,
+        'ip_address': snapshot.ip_address,
+        'subnet': snapshot.subnet,
+        'label': f"{firewall}: {snapshot.label}" if fleet.is_multi else snapshot.label,
+    } for firewall, snapshot in snapshots if snapshot.ip_address and snapshot.subnet]
+    # Hash only what is returned; hashing every interface's mappings would dominate the request.
+    return _conditional_json(payload, _payload_etag(payload, errors), errors)
+
+@api_bp.route('/capacity')
+@login_required
+def fleet_capacity():
+    """Capacity of every DHCP-enabled interface on every reachable firewall."""
+    fleet = get_fleet()
+    snapshots, errors = fleet.dhcp_interface_snapshots(version=_version())
+    payload = [dict(snapshot.capacity(), id=fleet.interface_id(firewall, snapshot.interface), firewall=firewall)
+               for firewall, snapshot in snapshots if snapshot.has_addressing]
+    return _conditional_json(payload, _payload_etag(payload, errors), errors)
+
+@api_bp.route('/capacity/report')
+@login_required
+def capacity_summaries():
+    """Utilisation, fragmentation and misplaced mappings of every DHCP-enabled interface, from the capacity engine."""
+    summaries, errors = capacity_report(get_fleet(), _version())
+    return _conditional_json(summaries, _payload_etag(summaries, errors), errors)
+
+def _interface_snapshot(interface):
+    """
+    Returns the snapshot of a '<firewall>/<interface>' id for the requested DHCP version. Aborts with 404 when
+    the interface has no such DHCP server and with 502 when pfSense cannot be read.
+    """
+    pfsense_api, interface = resolve_interface(interface)
+    try:
+        return pfsense_api.get_interface_snapshot(interface, version=_version())
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            abort(404)
+        abort(502)
+    except requests.exceptions.RequestException:
+        abort(502)
+
+@api_bp.route('/interfaces/<path:interface>/capacity')
+@login_required
+def capacity(interface):
+    snapshot = _interface_snapshot(interface)
+    return _conditional_json(snapshot.capacity(), snapshot.etag)
+
+@api_bp.route('/interfaces/<path:interface>/mappings')
+@login_required
+def mappings(interface):
+    snapshot = _interface_snapshot(interface)
+    payload = [{
+        'mac': mapping.get('mac'),
+        'duid': mapping.get('duid'),
+        'ipaddr': mapping_ip(mapping),
+        'hostname': mapping.get('hostname'),
+        'descr': mapping.get('descr'),
+    } for mapping in snapshot.mappings]
+    return _conditional_json(payload, snapshot.etag)
+
+@api_bp.route('/jobs/<job_id>')
+@login_required
+def apply_job(job_id):
+    """Status of a background apply queued when a mapping was created: queued, running, done or failed."""
+    apply_queue = get_apply_queue(get_config())
+    job = apply_queue.status(job_id) if apply_queue else None
+    if job is None:
+        abort(404)
+    response = jsonify(job)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
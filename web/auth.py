@@ -1,10 +1,10 @@
+import hmac
 from functools import wraps
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
+from flask import Blueprint, Response, render_template, request, redirect, url_for, flash, session, current_app
 from werkzeug.security import check_password_hash
 from web.forms import LoginForm
-from static_mapping.config import load_config
+from web.pfsense import get_config
 
-config = load_config()
 auth_bp = Blueprint('auth', __name__)
 
 def login_required(f):
@@ -15,12 +15,33 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated
 
+def login_or_token_required(section):
+    """
+    Like login_required, but also accepts 'Authorization: Bearer <token>' when `token` is set in
+    the given config section, for scripts and scrapers that cannot log in. A wrong token gets 401.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if 'logged_in' in session:
+                return f(*args, **kwargs)
+            authorization = request.headers.get('Authorization')
+            if authorization is None:
+                return redirect(url_for('auth.login'))
+            token = get_config().get(section, 'token', fallback='')
+            if not token or not hmac.compare_digest(authorization, f"Bearer {token}"):
+                return Response('Unauthorized\n', status=401, mimetype='text/plain')
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     form = LoginForm()
     if form.validate_on_submit():
         username = form.username.data
         password = form.password.data
+        config = get_config()
         stored_username = config.get('auth', 'username')
         stored_password_hash = config.get('auth', 'password_hash')
         if username == stored_username and check_password_hash(stored_password_hash, password):
@@ -0,0 +1,30 @@
+from datetime import datetime, timezone
+from flask import Blueprint, Response, request, session, abort, stream_with_context, current_app
+from static_mapping.export import EXPORT_FORMATS, iter_mapping_batches, export_chunks
+from web.auth import login_or_token_required
+from web.pfsense import get_fleet
+
+export_bp = Blueprint('export', __name__)
+
+@export_bp.route('/export.<fmt>')
+@login_or_token_required('export')
+def export_mappings(fmt):
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    version = request.args.get('version', 4, type=int)
+    if version not in (4, 6):
+        abort(400)
+    fresh = request.args.get('fresh', '0') in ('1', 'true', 'yes')
+
+    logger = current_app.logger
+    logger.info(f"User '{session.get('username', 'token')}' exported static mappings as {fmt}.")
+    errors = []
+
+    def generate():
+        yield from export_chunks(iter_mapping_batches(get_fleet(), version, fresh, errors), fmt)
+        for firewall, interface, message in errors:
+            logger.error(f"Export skipped firewall '{firewall}'{f' interface {interface}' if interface else ''}: {message}")
+
+    filename = f"static-mappings-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.{fmt}"
+    return Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"', 'Cache-Control': 'no-store'})
@@ -1,18 +1,37 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, SubmitField, PasswordField, RadioField
-from wtforms.validators import DataRequired, Regexp
+from wtforms.validators import DataRequired, Optional, Regexp
+from static_mapping.mapping_index import MAC_ADDRESS_RE
 
 class MappingForm(FlaskForm):
     interface = RadioField('Interface', choices=[], validators=[DataRequired()])
     hostname = StringField('Hostname', validators=[DataRequired()])
     description = StringField('Description', validators=[DataRequired()])
     mac_address = StringField('MAC Address', validators=[
-        DataRequired(),
-        Regexp(r'^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$',
-               message="Invalid MAC address format.")
+        Optional(),
+        Regexp(MAC_ADDRESS_RE, message="Invalid MAC address format.")
     ])
+    # A DUID instead of a MAC address creates a DHCPv6 mapping
+    duid = StringField('DHCPv6 Client DUID', validators=[Optional()])
     submit = SubmitField('Add Mapping')
 
+    def validate(self, extra_validators=None):
+        if not super().validate(extra_validators):
+            return False
+        if bool(self.mac_address.data) == bool(self.duid.data):
+            self.mac_address.errors.append("Enter a MAC address, or a DUID for a DHCPv6 mapping.")
+            return False
+        return True
+
+class BulkImportForm(FlaskForm):
+    interface = RadioField('Default Interface', choices=[], validators=[DataRequired()])
+    mappings_file = FileField('Mappings File (CSV or JSON)', validators=[
+        FileRequired(),
+        FileAllowed(['csv', 'json'], message="Upload a .csv or .json file.")
+    ])
+    submit = SubmitField('Import Mappings')
+
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
     password = PasswordField('Password', validators=[DataRequired()])
@@ -0,0 +1,28 @@
+import time
+from flask import Blueprint, Response, request, g
+from static_mapping import metrics
+from web.auth import login_or_token_required
+
+metrics_bp = Blueprint('metrics', __name__)
+
+def start_request_trace():
+    g.request_started = time.perf_counter()
+    g.trace = metrics.start_trace()
+
+def finish_request_trace(response):
+    """Adds per-request upstream call counts to the response headers and records request metrics."""
+    trace = g.get('trace')
+    if trace is None:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or 'unknown'
+    metrics.HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    metrics.HTTP_UPSTREAM_CALLS.observe(trace.upstream_calls, endpoint=endpoint)
+    response.headers['X-Upstream-Calls'] = str(trace.upstream_calls)
+    response.headers['X-Upstream-Time'] = f"{trace.upstream_seconds * 1000:.1f}ms"
+    return response
+
+@metrics_bp.route('/metrics')
+@login_or_token_required('metrics')
+def prometheus_metrics():
+    return Response(metrics.expose(), mimetype='text/plain; version=0.0.4')
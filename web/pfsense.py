@@ -0,0 +1,26 @@
+from flask import current_app, abort
+from static_mapping.fleet import split_interface_id
+
+def get_config():
+    """Returns the application's current configuration, re-read only when config.ini changes."""
+    return current_app.extensions['config_store'].config
+
+def get_fleet():
+    """Returns the application-scoped FirewallFleet."""
+    return current_app.extensions['config_store'].fleet
+
+def resolve_interface(value):
+    """Returns (pfsense_api, interface) for a '<firewall>/<interface>' id, or aborts with 404 for an unknown firewall."""
+    fleet = get_fleet()
+    firewall, interface = split_interface_id(value, fleet.default.name)
+    try:
+        return fleet.get(firewall), interface
+    except KeyError:
+        abort(404)
+
+def interface_choices():
+    """Returns form choices for the DHCP-enabled interfaces of every reachable firewall."""
+    fleet = get_fleet()
+    snapshots, _ = fleet.dhcp_interface_snapshots()
+    return [(fleet.interface_id(firewall, snapshot.interface), f"{firewall}: {snapshot.label}" if fleet.is_multi else snapshot.label)
+            for firewall, snapshot in snapshots if snapshot.ip_address and snapshot.subnet]
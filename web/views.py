@@ -1,10 +1,12 @@
-import configparser
 from flask import Blueprint, render_template, request, redirect, url_for, flash, get_flashed_messages, session, current_app
-from web.forms import MappingForm
+import os
+from web.forms import MappingForm, BulkImportForm
 from static_mapping.core import create_static_mapping_entry
-from static_mapping.utils import count_available_ips
-from static_mapping.api import PfSenseAPI
+from static_mapping.bulk import parse_rows, import_static_mappings
+from static_mapping.apply_queue import get_apply_queue
+from static_mapping.capacity import cached_summary, capacity_report
 from web.auth import login_required
+from web.pfsense import get_config, get_fleet, resolve_interface, interface_choices
 
 views_bp = Blueprint('views', __name__)
 
@@ -13,72 +15,32 @@ views_bp = Blueprint('views', __name__)
 def index():
     form = MappingForm()
 
-    # Load config for PfSenseAPI initialization
-    pfsense_config = configparser.ConfigParser()
-    pfsense_config.read('config.ini')
-
-    # Initialize PfSenseAPI
-    pfsense_api = PfSenseAPI(pfsense_config, current_app.logger)
-
-    # Get interfaces with DHCP server enabled
-    dhcp_interfaces = pfsense_api.get_dhcp_server_interfaces()
-    current_app.logger.info(f"DHCP interfaces: {dhcp_interfaces}")
-    available_interfaces = pfsense_api.get_available_interfaces()
-    
-
-    # Filter available interfaces to only include those with DHCP server enabled
-    interfaces_with_dhcp = [iface for iface in available_interfaces if iface['in_use_by'] in dhcp_interfaces]
-    
-
-    # Get subnet for each interface and create choices for the form
-    interface_choices = []
-    for iface in interfaces_with_dhcp:
-        ip_address, subnet, description = pfsense_api.get_interface_details(iface['in_use_by'])
-        if ip_address and subnet:
-            interface_choices.append((iface['in_use_by'], f"{description} ({ip_address}/{subnet})"))
-
-    form.interface.choices = interface_choices
-
-    # Set default interface if not a POST request or if form validation fails
-    if not form.is_submitted() or not form.validate():
-        if interface_choices:
-            form.interface.data = interface_choices[0][0]
-
-    # Get existing mappings and DHCP range for available IP count
-    if request.method == 'POST' and form.validate_on_submit():
-        selected_interface = form.interface.data
-        existing_maps = pfsense_api.get_existing_static_mappings(selected_interface)
-        interface_ip, interface_subnet, _ = pfsense_api.get_interface_details(selected_interface)
-        dhcp_range_from, dhcp_range_to = pfsense_api.get_dhcp_range(selected_interface)
-    else:
-        # For GET request, show available IPs for the first interface in the list
-        if interface_choices:
-            first_interface = interface_choices[0][0]
-            existing_maps = pfsense_api.get_existing_static_mappings(first_interface)
-            interface_ip, interface_subnet, _ = pfsense_api.get_interface_details(first_interface)
-            dhcp_range_from, dhcp_range_to = pfsense_api.get_dhcp_range(first_interface)
-        else:
-            existing_maps = []
-            interface_ip, interface_subnet, dhcp_range_from, dhcp_range_to = None, None, None, None
-
-    available_ips_count = 0
-    if interface_ip and interface_subnet and dhcp_range_from and dhcp_range_to:
-        available_ips_count = count_available_ips(existing_maps, interface_ip, interface_subnet, dhcp_range_from, dhcp_range_to)
+    # On GET the page renders straight away and the browser loads interfaces and
+    # capacity from the JSON API; a POST needs the interface choices to validate against.
+    if request.method == 'POST':
+        form.interface.choices = interface_choices()
 
     if form.validate_on_submit():
-        interface = form.interface.data
+        pfsense_api, interface = resolve_interface(form.interface.data)
         hostname = form.hostname.data
         description = form.description.data
-        mac_address = form.mac_address.data
+        mac_address = form.mac_address.data or None
+        duid = form.duid.data or None
 
-        success, message, _ = create_static_mapping_entry(interface, mac_address, hostname, description, current_app.logger)
+        config = get_config()
+        success, message, _, job_id = create_static_mapping_entry(interface, mac_address, hostname, description, current_app.logger,
+                                                                  config=config, pfsense_api=pfsense_api, fleet=get_fleet(),
+                                                                  duid=duid, apply_queue=get_apply_queue(config))
 
         if success:
             flash(message, 'success')
-            current_app.logger.info(f"User '{session.get('username')}' created a new static mapping for MAC address '{mac_address}'.")
+            if job_id:
+                # The page polls this job until pfSense has applied the change
+                session['apply_job'] = job_id
+            current_app.logger.info(f"User '{session.get('username')}' created a new static mapping for {'DUID' if duid else 'MAC address'} '{duid or mac_address}'.")
         else:
             flash(message, 'error')
-            current_app.logger.error(f"Failed to create static mapping for MAC address '{mac_address}'. Reason: {message}")
+            current_app.logger.error(f"Failed to create static mapping for {'DUID' if duid else 'MAC address'} '{duid or mac_address}'. Reason: {message}")
         return redirect(url_for('views.index'))
 
     messages = get_flashed_messages(with_categories=True)
@@ -88,21 +50,75 @@ def index():
             success_flag = True
             break
             
-    return render_template('index.html', form=form, messages=messages, success_flag=success_flag, available_ips_count=available_ips_count)
+    return render_template('index.html', form=form, messages=messages, success_flag=success_flag,
+                           apply_job=session.pop('apply_job', None))
 
-@views_bp.route('/get_available_ips/<interface>')
+@views_bp.route('/get_available_ips/<path:interface>')
 @login_required
 def get_available_ips(interface):
-    pfsense_config = configparser.ConfigParser()
-    pfsense_config.read('config.ini')
-    pfsense_api = PfSenseAPI(pfsense_config, current_app.logger)
+    pfsense_api, interface = resolve_interface(interface)
+
+    snapshot = pfsense_api.get_interface_snapshot(interface)
 
-    existing_maps = pfsense_api.get_existing_static_mappings(interface)
-    interface_ip, interface_subnet, _ = pfsense_api.get_interface_details(interface)
-    dhcp_range_from, dhcp_range_to = pfsense_api.get_dhcp_range(interface)
+    summary = cached_summary(snapshot)
+    return str(summary['free'] if summary else 0)
+
+@views_bp.route('/capacity')
+@login_required
+def capacity():
+    version = request.args.get('version', 4, type=int)
+    if version not in (4, 6):
+        version = 4
+    summaries, errors = capacity_report(get_fleet(), version)
+    sort = request.args.get('sort', 'utilisation')
+    if sort in ('utilisation', 'fragmentation', 'free'):
+        summaries.sort(key=lambda summary: summary[sort], reverse=sort != 'free')
+    for firewall, error in errors.items():
+        flash(f"Firewall '{firewall}' did not respond: {error}", 'error')
+    return render_template('capacity.html', summaries=summaries, version=version, sort=sort,
+                           show_firewall=get_fleet().is_multi)
+
+
+@views_bp.route('/bulk', methods=['GET', 'POST'])
+@login_required
+def bulk_import():
+    form = BulkImportForm()
 
-    available_ips_count = 0
-    if interface_ip and interface_subnet and dhcp_range_from and dhcp_range_to:
-        available_ips_count = count_available_ips(existing_maps, interface_ip, interface_subnet, dhcp_range_from, dhcp_range_to)
+    form.interface.choices = interface_choices()
+    if not form.is_submitted() and form.interface.choices:
+        form.interface.data = form.interface.choices[0][0]
 
-    return str(available_ips_count)
+    results = None
+    applied = False
+    if form.validate_on_submit():
+        upload = form.mappings_file.data
+        fmt = os.path.splitext(upload.filename)[1].lstrip('.').lower()
+        try:
+            rows = parse_rows(upload.read(), fmt)
+        except ValueError as e:
+            flash(f"Could not read '{upload.filename}': {e}", 'error')
+            return redirect(url_for('views.bulk_import'))
+
+        # Every row goes to the firewall of the selected interface
+        pfsense_api, interface = resolve_interface(form.interface.data)
+        results, applied = import_static_mappings(rows, current_app.logger, default_interface=interface,
+                                                  config=get_config(), pfsense_api=pfsense_api, fleet=get_fleet())
+        created = sum(1 for result in results if result['status'] == 'created')
+        current_app.logger.info(f"User '{session.get('username')}' bulk imported {created} of {len(results)} static mappings from '{upload.filename}'.")
+        if created and applied:
+            flash(f"{created} of {len(results)} static mappings created and changes applied.", 'success')
+        elif created:
+            flash(f"{created} of {len(results)} static mappings created, but failed to apply changes.", 'error')
+        else:
+            flash(f"No static mappings were created from {len(results)} rows.", 'error')
+
+    return render_template('bulk.html', form=form, results=results, applied=applied)
+
+@views_bp.route('/refresh', methods=['POST'])
+@login_required
+def refresh():
+    for pfsense_api in get_fleet().firewalls.values():
+        pfsense_api.invalidate_cache()
+    current_app.logger.info(f"User '{session.get('username')}' refreshed the pfSense cache.")
+    flash('Interface and mapping data refreshed from pfSense.', 'info')
+    return redirect(url_for('views.index'))